@@ -2,172 +2,646 @@
 Complete Hybrid Sales Agent - LLM for Intent + ALL Hardcoded SQL Queries
 Includes ALL queries from the provided documentation
 """
+import asyncio
+import concurrent.futures
+import copy
+import hashlib
+import logging
 import os
 import json
+import queue
 import re
-from datetime import datetime, timedelta
+import textwrap
+import threading
+import time
+from dataclasses import dataclass
+from logging.handlers import QueueHandler, QueueListener
+from functools import lru_cache
+from string import Template
+from datetime import date, datetime, timedelta
 from database.db_connection import db
+import httpx
+import orjson
+import pandas as pd
 import requests
+from requests.adapters import HTTPAdapter, Retry
+from cachetools import LRUCache, TTLCache
 from dotenv import load_dotenv
 import streamlit as st
-load_dotenv()
-
-
-class SalesAgent:
-    """Complete hybrid approach with all documented queries"""
-
-    def __init__(self):
-        # Initialize Groq
-        self.api_key = st.secrets["GROQ_API_KEY"]
-        if not self.api_key:
-            raise ValueError("GROQ_API_KEY not found in environment variables")
 
-        self.api_url = "https://api.groq.com/openai/v1/chat/completions"
-        self.model = "llama-3.1-8b-instant"
+try:
+    import redis
+except ImportError:
+    redis = None
 
-        # Load all hardcoded query templates
-        self.query_templates = self._load_query_templates()
+load_dotenv()
+
+# ============================================================================
+# LOGGING
+# ============================================================================
+# print() takes the GIL and a write syscall on the request path; under
+# concurrent Streamlit sessions that contention is measurable. Records go
+# through a queue to a background listener thread, so the request path
+# only enqueues, and %s-style args defer formatting until a record is
+# actually emitted. Level INFO by default; SALES_AGENT_LOG_LEVEL=DEBUG
+# turns on the verbose intent/SQL dumps.
+_LOG = logging.getLogger(__name__)
+if not _LOG.handlers:
+    _log_queue = queue.SimpleQueue()
+    _LOG.addHandler(QueueHandler(_log_queue))
+    _LOG.setLevel(os.getenv('SALES_AGENT_LOG_LEVEL', 'INFO').upper())
+    _LOG.propagate = False
+    _LOG_LISTENER = QueueListener(_log_queue, logging.StreamHandler())
+    _LOG_LISTENER.start()
+
+# ============================================================================
+# SHARED HTTP SESSION (keep-alive to api.groq.com)
+# ============================================================================
+# A bare requests.post pays the full TCP+TLS handshake on every call. The
+# shared session reuses connections and absorbs transient 429/5xx with
+# retries instead of surfacing them to the user.
+_SESSION = requests.Session()
+_SESSION.mount("https://", HTTPAdapter(
+    pool_connections=4,
+    pool_maxsize=16,
+    max_retries=Retry(
+        total=2,
+        backoff_factor=0.3,
+        status_forcelist=[429, 500, 502, 503, 504]
+    )
+))
+
+# ============================================================================
+# GROQ RATE LIMITER
+# ============================================================================
+# Proactive client-side token bucket sized to the account's requests-per-
+# minute budget (GROQ_RPM, default 30). Waiting a few hundred ms locally
+# beats burning a TCP round-trip on a guaranteed 429 and then riding the
+# retry backoff. Shared across sessions: it's module state, and Streamlit
+# workers import this module once per process.
+_GROQ_RPM = int(os.getenv('GROQ_RPM', '30'))
+
+
+class _TokenBucket:
+    """Thread-safe token bucket; acquire() blocks until a slot frees up"""
+
+    def __init__(self, rate, capacity):
+        self._rate = rate
+        self._capacity = capacity
+        self._tokens = float(capacity)
+        self._updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def acquire(self):
+        while True:
+            with self._lock:
+                now = time.monotonic()
+                self._tokens = min(
+                    self._capacity,
+                    self._tokens + (now - self._updated) * self._rate
+                )
+                self._updated = now
+                if self._tokens >= 1:
+                    self._tokens -= 1
+                    return
+                wait = (1 - self._tokens) / self._rate
+            time.sleep(wait)
+
+    def penalize(self, seconds):
+        """Put the bucket into debt after a server-side 429"""
+        with self._lock:
+            self._tokens = min(self._tokens, -seconds * self._rate)
+            self._updated = time.monotonic()
+
+
+_RATE_LIMITER = _TokenBucket(rate=_GROQ_RPM / 60.0, capacity=_GROQ_RPM)
+
+
+# ============================================================================
+# INTENT/LLM RESPONSE CACHE
+# ============================================================================
+# Groq round-trips cost hundreds of ms; identical questions ("sales today",
+# "top 5 products") are asked over and over. Cache responses keyed by a
+# canonicalized prompt so repeats skip the network entirely.
+_INTENT_CACHE = TTLCache(maxsize=1024, ttl=3600)
+_INTENT_CACHE_LOCK = threading.Lock()
+
+_WHITESPACE_RE = re.compile(r'\s+')
+_STOP_WORDS = frozenset(['a', 'an', 'the', 'please', 'me', 'my', 'our'])
+
+# Compiled once; used to clean LLM responses on every turn
+_CODE_FENCE_RE = re.compile(r'^```(?:json)?\s*|\s*```$', re.MULTILINE)
+_JSON_BLOCK_RE = re.compile(r'\{.*\}', re.DOTALL)
+_TRAILING_COMMA_RE = re.compile(r',\s*([}\]])')
+
+
+def _loads_lenient(text):
+    """
+    Parse LLM JSON, tolerating trailing commas
+
+    The model occasionally emits almost-valid JSON; stripping trailing
+    commas and reparsing rescues it without a second Groq round-trip.
+    """
+    try:
+        return orjson.loads(text)
+    except orjson.JSONDecodeError:
+        return orjson.loads(_TRAILING_COMMA_RE.sub(r'\1', text))
+
+_SYSTEM_PROMPT = (
+    "You are an intent classifier for a sales analytics system. "
+    "Return ONLY valid JSON, no other text."
+)
+
+
+def _strip_stop_words(text):
+    """Drop stop words from an already lowercased, collapsed string"""
+    return ' '.join(w for w in text.split(' ') if w not in _STOP_WORDS)
+
+
+def _canonicalize_prompt(prompt):
+    """Normalize a prompt into a stable cache key (lowercase, collapsed
+    whitespace, stop-words stripped)"""
+    return _strip_stop_words(_WHITESPACE_RE.sub(' ', prompt.strip().lower()))
+
+
+def clear_intent_cache():
+    """Flush the cached LLM responses (admin/debug use)"""
+    with _INTENT_CACHE_LOCK:
+        _INTENT_CACHE.clear()
+
+
+# ============================================================================
+# SQL RESULT CACHE
+# ============================================================================
+# The aggregation templates are heavy GROUP BY/JOIN scans that change slowly.
+# Cache results per (template, params, today) with a TTL matched to how fast
+# each period moves: today-level numbers go stale quickly, yearly ones don't.
+# Including today's date in the key auto-invalidates everything at midnight.
+_RESULT_CACHE_LOCK = threading.Lock()
+_RESULT_CACHES = {
+    'fast': TTLCache(maxsize=512, ttl=60),      # *_today templates
+    'medium': TTLCache(maxsize=512, ttl=600),   # monthly templates
+    'slow': TTLCache(maxsize=512, ttl=3600),    # yearly / trend templates
+}
+
+
+# Optional Redis-backed L2 result cache. The TTLCaches above are
+# per-process; under multiple Streamlit workers their hit rates collapse.
+# When REDIS_URL is set (and redis is installed), results are shared
+# across processes behind the same key scheme. Any Redis problem degrades
+# silently to the L1-only path.
+def clear_result_caches():
+    """Flush the L1 result caches (admin/debug use, e.g. after a backfill)"""
+    with _RESULT_CACHE_LOCK:
+        for cache in _RESULT_CACHES.values():
+            cache.clear()
+
+
+# ============================================================================
+# RESPONSE CACHE
+# ============================================================================
+# Full formatted answers keyed by (tenant, canonicalized question, day).
+# A hit skips the whole pipeline — classification, SQL, formatting — for
+# the question a user (or a rerun) asks twice. Five minutes bounds
+# staleness for intraday numbers; the day in the key rolls everything
+# over at midnight.
+_RESPONSE_CACHE = TTLCache(maxsize=512, ttl=300)
+_RESPONSE_CACHE_LOCK = threading.Lock()
+
+
+_REDIS_TTLS = {'fast': 60, 'medium': 600, 'slow': 3600}
+_REDIS_CLIENT = None
 
-    def _call_groq(self, prompt, max_tokens=800, temperature=0.1):
-        """Call Groq API"""
-        headers = {
-            "Authorization": f"Bearer {self.api_key}",
-            "Content-Type": "application/json"
-        }
-
-        data = {
-            "model": self.model,
-            "messages": [
-                {
-                    "role": "system",
-                    "content": "You are an intent classifier for a sales analytics system. Return ONLY valid JSON, no other text."
-                },
-                {
-                    "role": "user",
-                    "content": prompt
-                }
-            ],
-            "max_tokens": max_tokens,
-            "temperature": temperature
-        }
 
+def _get_redis():
+    """Shared L2 cache client, or None when Redis isn't configured"""
+    global _REDIS_CLIENT
+    if redis is None or not os.getenv('REDIS_URL'):
+        return None
+    if _REDIS_CLIENT is None:
         try:
-            response = requests.post(self.api_url, headers=headers, json=data, timeout=30)
-            response.raise_for_status()
-            result = response.json()
-
-            if 'choices' not in result or len(result['choices']) == 0:
-                raise Exception(f"Invalid response structure: {result}")
-
-            return result['choices'][0]['message']['content'].strip()
-
-        except requests.exceptions.RequestException as e:
-            print(f"Groq API Error: {e}")
-            raise Exception(f"Failed to get response from Groq: {str(e)}")
+            _REDIS_CLIENT = redis.Redis.from_url(
+                os.environ['REDIS_URL'], socket_timeout=0.2
+            )
+        except Exception as e:
+            _LOG.warning("⚠️ Redis unavailable, running L1-only: %s", e)
+            return None
+    return _REDIS_CLIENT
+
+
+# Worker pool for running independent SQL sub-queries side by side; safe
+# because the MySQL driver releases the GIL while waiting on the network
+# and each worker checks its own connection out of the pool.
+_EXECUTOR = concurrent.futures.ThreadPoolExecutor(max_workers=8)
+
+
+def _warm_db_pool():
+    """Check a connection out and back in so the pool (and its ping) is
+    paid for before the query that needs it; best-effort"""
+    try:
+        connection = db.get_connection()
+        if connection is not None:
+            connection.close()
+    except Exception:
+        pass
+
+# Single-flight tables: when several sessions miss the cache on the same
+# key simultaneously (e.g. right after TTL expiry), only the first runs
+# the query/LLM call; the rest wait on its future instead of piling onto
+# MySQL or Groq.
+_INFLIGHT_LOCK = threading.Lock()
+_SQL_INFLIGHT = {}
+_GROQ_INFLIGHT = {}
+
+
+def _join_flight(table, key):
+    """
+    Join or start a single-flight entry for key
+
+    Returns:
+        Tuple of (future, leader): leader=True means the caller must run
+        the work, resolve the future, and release the entry.
+    """
+    with _INFLIGHT_LOCK:
+        flight = table.get(key)
+        if flight is not None:
+            return flight, False
+        flight = concurrent.futures.Future()
+        table[key] = flight
+        return flight, True
+
+
+def _release_flight(table, key):
+    """Drop a finished single-flight entry"""
+    with _INFLIGHT_LOCK:
+        table.pop(key, None)
+
+
+def _today_bounds():
+    """
+    Compute date-window boundaries Python-side for parameter binding
+
+    Embedding CURDATE()/DATE_FORMAT(CURDATE(), ...) in the SQL text makes
+    the statement non-deterministic, which defeats MySQL plan/result-cache
+    matching. Binding explicit dates keeps the statement text stable for
+    the whole day.
+    """
+    today = date.today()
+    month_start = today.replace(day=1)
+    year_start = today.replace(month=1, day=1)
+    last_month_start = (month_start - timedelta(days=1)).replace(day=1)
+    return {
+        'day_start': today.isoformat(),
+        'day_end': (today + timedelta(days=1)).isoformat(),
+        'month_start': month_start.isoformat(),
+        'year_start': year_start.isoformat(),
+        'last_month_start': last_month_start.isoformat(),
+        'last_year_start': year_start.replace(year=year_start.year - 1).isoformat(),
+    }
+
+
+@lru_cache(maxsize=64)
+def _date_filter_fragment(time_period, today_iso, column):
+    """
+    Build a date-filter SQL fragment with concrete date literals
+
+    Memoized per (period, day, column): the same fragment string is
+    reused for the whole day instead of being rebuilt on every turn, and
+    the concrete dates keep the SQL text deterministic (no CURDATE()),
+    which the plan/result caches depend on.
+    """
+    today = date.fromisoformat(today_iso)
+    tomorrow = (today + timedelta(days=1)).isoformat()
+
+    if time_period == "today":
+        if column == 'sales_day':
+            return f"AND sales_day = '{today_iso}'"
+        return f"AND {column} >= '{today_iso}' AND {column} < '{tomorrow}'"
+
+    if time_period == "this_month":
+        start = today.replace(day=1).isoformat()
+    elif time_period == "this_year":
+        start = today.replace(month=1, day=1).isoformat()
+    elif time_period.startswith("last_"):
+        days = int(time_period.replace("last_", "").replace("_days", ""))
+        start = (today - timedelta(days=days)).isoformat()
+    else:
+        return ""
+
+    if column == 'sales_day' or time_period.startswith("last_"):
+        return f"AND {column} >= '{start}'"
+    return f"AND {column} >= '{start}' AND {column} < '{tomorrow}'"
+
+
+# Canonical period labels; built once instead of a fresh dict per call
+_DATE_LABELS = {
+    "today": "Today",
+    "this_month": "This Month",
+    "this_year": "This Year",
+    "last_30_days": "Last 30 Days",
+    "last_60_days": "Last 60 Days",
+    "last_90_days": "Last 90 Days",
+    "all_time": "All Time",
+}
+
+
+@lru_cache(maxsize=64)
+def _date_label(time_period):
+    """Human-readable period label; open-ended last_N_days interned on use"""
+    return _DATE_LABELS.get(time_period) or time_period.replace("_", " ").title()
+
+
+def _result_cache_tier(template_name):
+    """Pick the TTL tier for a template based on how volatile its period is"""
+    if 'today' in template_name or 'dashboard' in template_name:
+        return 'fast'
+    if 'year' in template_name or 'trend' in template_name:
+        return 'slow'
+    return 'medium'
+
+
+# ============================================================================
+# FAST INTENT ROUTER
+# ============================================================================
+# Most utterances are predictable phrasings of the same few questions
+# ("sales today", "today's sales", "how much did we sell today"). Resolving
+# them with regexes skips the Groq round-trip entirely; the LLM only sees
+# genuinely ambiguous inputs.
+@dataclass(slots=True, frozen=True)
+class Intent:
+    """
+    A classified user question
+
+    Slots keep instances small and attribute access C-level; frozen makes
+    them immutable, so cached intents can be shared across sessions
+    without defensive copies.
+    """
+    query_type: str
+    time_period: str
+    limit: int = 10
+    days: int = 30
+    confidence: float = 0.0
+
+
+_TOP_N_RE = re.compile(r'\btop\s+(\d+)\b')
+_DAYS_RE = re.compile(r'(\d+)\s*days?\b')
+# All period phrases in one alternation; _detect_time_period scans the
+# message once and applies precedence over whatever the pass found
+_TIME_PERIOD_RE = re.compile(
+    r'\b(?:(?P<today>today)|last\s+(?P<days>\d+)\s+days?'
+    r'|(?P<month>month)|(?P<year>year))\b'
+)
+_INACTIVE_RE = re.compile(r"\b(?:haven'?t|not)\s+(?:bought|purchased)\b|\binactive\b")
+_LEGACY_INACTIVE_RE = re.compile(r'^inactive_customers_(\d+)_days$')
+_LEGACY_NET_SALES_RE = re.compile(r'^net_sales_(today|this_month|this_year)$')
+
+# Ordered most-specific-first; first match wins. None as time_period means
+# "detect from the message".
+_FAST_ROUTES = [
+    (re.compile(r'\breturns?\b.*\btoday\b|\btoday\b.*\breturns?\b'), 'returns_today', 'today'),
+    (re.compile(r'\breturns?\b.*\b(this\s+)?month\b'), 'returns_this_month', 'this_month'),
+    (re.compile(r'\breturns?\b.*\b(this\s+)?year\b'), 'returns_this_year', 'this_year'),
+    (re.compile(r'\bnet\s+sales\b'), 'net_sales', None),
+    (re.compile(r'\bcompare\b.*\bmonth\b|\bmonth\b.*\bvs\b.*\bmonth\b'), 'compare_month', 'this_month'),
+    (re.compile(r'\bcompare\b.*\byear\b|\byear\b.*\bvs\b.*\byear\b'), 'compare_year', 'this_year'),
+    (re.compile(r'\b(sales\s+)?trend\b|\blast\s+12\s+months\b'), 'sales_trend_12_months', 'all_time'),
+    (re.compile(r'\bslow[\s-]*moving\b'), 'slow_moving_products', None),
+    (re.compile(r'\b(best|highest)\s+(sales\s+)?day\b'), 'highest_sales_day', None),
+    (re.compile(r'\b(worst|lowest)\s+(sales\s+)?day\b'), 'lowest_sales_day', None),
+    (re.compile(r'\b(most\s+profitable|highest[\s-]*profit)\s+product\b'), 'highest_profit_product', None),
+    (re.compile(r'\b(least\s+profitable|lowest[\s-]*profit)\s+product\b'), 'lowest_profit_product', None),
+    (re.compile(r'\b(best|highest|top)[\s-]*(selling\s+)?product\b'), 'highest_revenue_product', None),
+    (re.compile(r'\b(worst|lowest)[\s-]*(selling\s+)?product\b'), 'lowest_revenue_product', None),
+    (re.compile(r'\bproducts?\b.*\b(quantity|units)\b|\b(quantity|units)\b.*\bproducts?\b'), 'top_products_by_quantity', None),
+    (re.compile(r'\b(profitable|profit)\b.*\bproducts?\b|\bproducts?\b.*\bprofit\b'), 'top_products_by_profit', None),
+    (re.compile(r'\bproducts?\b.*\b(revenue|value|money)\b|\btop\b.*\bproducts?\b'), 'top_products_by_revenue', None),
+    (re.compile(r'\b(best|highest|top)\s+sales(person|man)\b'), 'highest_salesperson', None),
+    (re.compile(r'\b(worst|lowest)\s+sales(person|man)\b'), 'lowest_salesperson', None),
+    (re.compile(r'\btop\s+\d*\s*sales(people|persons|men)\b'), 'top_salespeople', None),
+    (re.compile(r'\b(best|highest|top)\s+(branch|warehouse)\b'), 'highest_sales_branch', None),
+    (re.compile(r'\b(worst|lowest)\s+(branch|warehouse)\b'), 'lowest_sales_branch', None),
+    (re.compile(r'\btop\s+\d*\s*(branches|warehouses)\b'), 'top_branches', None),
+    (re.compile(r'\btop\s+\d*\s*customers?\b|\bbest\s+customers?\b'), 'highest_revenue_customers', None),
+    (re.compile(r'\b(worst|lowest|bottom)\s+\d*\s*customers?\b'), 'lowest_revenue_customers', None),
+    (re.compile(r'\bcustomer[\s-]*wise\b|\bsales\s+by\s+customers?\b'), 'customer_wise_sales', None),
+    (re.compile(r'\bsales(person|man)[\s-]*wise\b|\bsales\s+by\s+sales(person|man|people|men)\b'), 'sales_by_salesperson', None),
+    (re.compile(r'\btop\s+\d*\s*categor(y|ies)\b'), 'top_categories', None),
+    (re.compile(r'\b(worst|lowest)\b.*\bcategor(y|ies)\b|\bcategor(y|ies)\b.*\b(worst|lowest)\b'), 'lowest_sales_category', None),
+    (re.compile(r'\b(categor(y|ies))\b.*\b(best|highest|top)\b|\b(best|highest|top)\b.*\bcategor(y|ies)\b'), 'highest_sales_category', None),
+    (re.compile(r'\b(how\s+many|total|number\s+of)\s+invoices\b'), 'total_invoices', None),
+    (re.compile(r'\b(sales|revenue|sell|sold)\b.*\btoday\b|\btoday\b.*\b(sales|revenue)\b'), 'sales_today', 'today'),
+    (re.compile(r'\b(sales|revenue)\b.*\b(this\s+)?month\b'), 'sales_this_month', 'this_month'),
+    (re.compile(r'\b(sales|revenue)\b.*\b(this\s+)?year\b'), 'sales_this_year', 'this_year'),
+]
+
+# All route patterns joined into one alternation: a message that matches
+# no route (the LLM-bound majority) is rejected in a single scan instead
+# of 30+ sequential pattern attempts. On a gate hit the ordered loop
+# below still decides which route wins.
+_FAST_ROUTE_GATE = re.compile(
+    '|'.join(f'(?:{pattern.pattern})' for pattern, _, _ in _FAST_ROUTES)
+)
+
+
+def _detect_time_period(msg):
+    """
+    Pull an explicit time period out of an already-lowercased message
+
+    One pass of the combined pattern instead of a scan per phrase;
+    precedence (today, explicit last-N-days window, month, year) is
+    applied over whatever the single pass found.
+    """
+    found = {}
+    for match in _TIME_PERIOD_RE.finditer(msg):
+        found.setdefault(match.lastgroup, match)
+
+    if 'today' in found:
+        return 'today'
+    if 'days' in found:
+        return f"last_{found['days'].group('days')}_days"
+    if 'month' in found:
+        return 'this_month'
+    if 'year' in found:
+        return 'this_year'
+    return 'all_time'
+
+
+def _fast_route(msg):
+    """
+    Pre-classify a message with regexes, skipping the LLM on a hit
+
+    Expects msg already lowercased with whitespace collapsed; the caller
+    normalizes once and shares the buffer across all matchers.
+
+    Returns:
+        An Intent, or None if no route matched and the LLM should decide.
+    """
+    # Inactive-customer questions first: "haven't bought" phrasing overlaps
+    # with the generic customer routes below
+    if _INACTIVE_RE.search(msg):
+        days_match = _DAYS_RE.search(msg)
+        days = int(days_match.group(1)) if days_match else 30
+        if 'month' in msg and not days_match:
+            days = 30
+        return Intent(
+            query_type="inactive_customers",
+            time_period=f"last_{days}_days",
+            limit=20,
+            days=days,
+            confidence=1.0,
+        )
+
+    if not _FAST_ROUTE_GATE.search(msg):
+        return None
+
+    for pattern, query_type, time_period in _FAST_ROUTES:
+        if pattern.search(msg):
+            top_n = _TOP_N_RE.search(msg)
+            return Intent(
+                query_type=query_type,
+                time_period=time_period or _detect_time_period(msg),
+                limit=int(top_n.group(1)) if top_n else 10,
+                confidence=1.0,
+            )
 
-    def _load_query_templates(self):
-        """Load ALL hardcoded SQL query templates from documentation"""
-        return {
+    return None
+
+
+# Templates served from the sales_daily_rollup table (see
+# database/sales_daily_rollup.sql) rather than raw sales_invoice scans
+_ROLLUP_TEMPLATES = frozenset([
+    'sales_trend_12_months', 'highest_sales_day', 'lowest_sales_day',
+    'top_products_by_quantity', 'slow_moving_products',
+    'highest_sales_category', 'lowest_sales_category', 'top_categories',
+    'top_products_by_revenue', 'highest_revenue_product',
+    'lowest_revenue_product', 'highest_profit_product',
+    'lowest_profit_product', 'top_products_by_profit',
+])
+
+# ============================================================================
+# SQL QUERY TEMPLATES (module-level, compiled once at import)
+# ============================================================================
+# Binding contract: every per-request value — company_id, limit, days and
+# the date-window bounds from _today_bounds() — is a driver-bound
+# %(name)s parameter, never interpolated into the SQL text. Only the
+# structural {date_filter} fragment is substituted textually (it changes
+# the statement shape, so it can't be a parameter). This keeps statement
+# text identical across tenants and limits, so MySQL's parse/plan caches
+# match, and it removes injection surface by construction.
+_QUERY_TEMPLATES = {
             # ============================================================================
             # SALES QUERIES (Document 1)
             # ============================================================================
             "sales_today": """
                 SELECT SUM(sales_invoice.total - COALESCE(sales_invoice.total_tax, 0)) AS total_sales
                 FROM sales_invoice
-                WHERE sales_invoice.company_id = {company_id}
-                  AND sales_invoice.invoice_date >= CURDATE()
-                  AND sales_invoice.invoice_date < CURDATE() + INTERVAL 1 DAY
+                WHERE sales_invoice.company_id = %(company_id)s
+                  AND sales_invoice.invoice_date >= %(day_start)s
+                  AND sales_invoice.invoice_date < %(day_end)s
                   AND sales_invoice.status NOT IN ('draft', 'draft_return', 'return', 'canceled')
             """,
 
             "sales_this_month": """
                 SELECT SUM(sales_invoice.total - COALESCE(sales_invoice.total_tax, 0)) AS total_sales
                 FROM sales_invoice
-                WHERE sales_invoice.company_id = {company_id}
-                  AND sales_invoice.invoice_date >= DATE_FORMAT(CURDATE(), '%Y-%m-01')
-                  AND sales_invoice.invoice_date < CURDATE() + INTERVAL 1 DAY
+                WHERE sales_invoice.company_id = %(company_id)s
+                  AND sales_invoice.invoice_date >= %(month_start)s
+                  AND sales_invoice.invoice_date < %(day_end)s
                   AND sales_invoice.status NOT IN ('draft', 'draft_return', 'return', 'canceled')
             """,
 
             "sales_this_year": """
                 SELECT SUM(sales_invoice.total - COALESCE(sales_invoice.total_tax, 0)) AS total_sales
                 FROM sales_invoice
-                WHERE sales_invoice.company_id = {company_id}
-                  AND sales_invoice.invoice_date >= DATE_FORMAT(CURDATE(), '%Y-01-01')
-                  AND sales_invoice.invoice_date < CURDATE() + INTERVAL 1 DAY
+                WHERE sales_invoice.company_id = %(company_id)s
+                  AND sales_invoice.invoice_date >= %(year_start)s
+                  AND sales_invoice.invoice_date < %(day_end)s
                   AND sales_invoice.status NOT IN ('draft', 'draft_return', 'return', 'canceled')
             """,
 
+            # Fused dashboard matrix: all nine sales/returns/net x
+            # today/month/year buckets from a single year-to-date scan
+            # instead of nine separate round-trips
+            "dashboard_summary": """
+                SELECT
+                    COALESCE(SUM(CASE WHEN invoice_date >= %(day_start)s AND status != 'return' THEN net ELSE 0 END), 0) AS sales_today,
+                    COALESCE(SUM(CASE WHEN invoice_date >= %(month_start)s AND status != 'return' THEN net ELSE 0 END), 0) AS sales_this_month,
+                    COALESCE(SUM(CASE WHEN status != 'return' THEN net ELSE 0 END), 0) AS sales_this_year,
+                    COALESCE(SUM(CASE WHEN invoice_date >= %(day_start)s AND status = 'return' THEN net ELSE 0 END), 0) AS returns_today,
+                    COALESCE(SUM(CASE WHEN invoice_date >= %(month_start)s AND status = 'return' THEN net ELSE 0 END), 0) AS returns_this_month,
+                    COALESCE(SUM(CASE WHEN status = 'return' THEN net ELSE 0 END), 0) AS returns_this_year,
+                    COALESCE(SUM(CASE WHEN invoice_date >= %(day_start)s THEN IF(status = 'return', -net, net) ELSE 0 END), 0) AS net_sales_today,
+                    COALESCE(SUM(CASE WHEN invoice_date >= %(month_start)s THEN IF(status = 'return', -net, net) ELSE 0 END), 0) AS net_sales_this_month,
+                    COALESCE(SUM(IF(status = 'return', -net, net)), 0) AS net_sales_this_year
+                FROM (
+                    SELECT invoice_date, status,
+                        total - COALESCE(total_tax, 0) AS net
+                    FROM sales_invoice
+                    WHERE company_id = %(company_id)s
+                      AND invoice_date >= %(year_start)s
+                      AND invoice_date < %(day_end)s
+                      AND status NOT IN ('draft', 'draft_return', 'canceled')
+                ) inv
+            """,
+
+            # Sealed year-to-date fragment: every day before today is frozen
+            # history served from the rollup; only today needs a live scan
+            "sales_year_sealed": """
+                SELECT COALESCE(SUM(net), 0) AS total_sales
+                FROM sales_daily_rollup
+                WHERE company_id = %(company_id)s
+                  AND status_bucket = 'sale'
+                  AND sales_day >= %(year_start)s
+                  AND sales_day < %(day_start)s
+            """,
+
             # ============================================================================
             # RETURNS QUERIES (Document 1)
             # ============================================================================
             "returns_today": """
                 SELECT SUM(sales_invoice.total - COALESCE(sales_invoice.total_tax, 0)) AS total_returns
                 FROM sales_invoice
-                WHERE sales_invoice.company_id = {company_id}
-                  AND sales_invoice.invoice_date >= CURDATE()
-                  AND sales_invoice.invoice_date < CURDATE() + INTERVAL 1 DAY
+                WHERE sales_invoice.company_id = %(company_id)s
+                  AND sales_invoice.invoice_date >= %(day_start)s
+                  AND sales_invoice.invoice_date < %(day_end)s
                   AND sales_invoice.status = 'return'
             """,
 
             "returns_this_month": """
                 SELECT SUM(sales_invoice.total - COALESCE(sales_invoice.total_tax, 0)) AS total_returns
                 FROM sales_invoice
-                WHERE sales_invoice.company_id = {company_id}
-                  AND sales_invoice.invoice_date >= DATE_FORMAT(CURDATE(), '%Y-%m-01')
-                  AND sales_invoice.invoice_date < CURDATE() + INTERVAL 1 DAY
+                WHERE sales_invoice.company_id = %(company_id)s
+                  AND sales_invoice.invoice_date >= %(month_start)s
+                  AND sales_invoice.invoice_date < %(day_end)s
                   AND sales_invoice.status = 'return'
             """,
 
             "returns_this_year": """
                 SELECT SUM(sales_invoice.total - COALESCE(sales_invoice.total_tax, 0)) AS total_returns
                 FROM sales_invoice
-                WHERE sales_invoice.company_id = {company_id}
-                  AND sales_invoice.invoice_date >= DATE_FORMAT(CURDATE(), '%Y-01-01')
-                  AND sales_invoice.invoice_date < CURDATE() + INTERVAL 1 DAY
+                WHERE sales_invoice.company_id = %(company_id)s
+                  AND sales_invoice.invoice_date >= %(year_start)s
+                  AND sales_invoice.invoice_date < %(day_end)s
                   AND sales_invoice.status = 'return'
             """,
 
             # ============================================================================
             # NET SALES QUERIES (Document 1)
             # ============================================================================
-            "net_sales_today": """
-                SELECT COALESCE(
-                    SUM(CASE
-                        WHEN sales_invoice.status = 'return' THEN -(sales_invoice.total - COALESCE(sales_invoice.total_tax, 0))
-                        ELSE (sales_invoice.total - COALESCE(sales_invoice.total_tax, 0))
-                    END), 0) AS net_sales
-                FROM sales_invoice
-                WHERE sales_invoice.company_id = {company_id}
-                  AND sales_invoice.invoice_date >= CURDATE()
-                  AND sales_invoice.invoice_date < CURDATE() + INTERVAL 1 DAY
-                  AND sales_invoice.status NOT IN('draft', 'draft_return', 'canceled')
-            """,
-
-            "net_sales_this_month": """
-                SELECT COALESCE(
-                    SUM(CASE
-                        WHEN sales_invoice.status = 'return' THEN -(sales_invoice.total - COALESCE(sales_invoice.total_tax, 0))
-                        ELSE (sales_invoice.total - COALESCE(sales_invoice.total_tax, 0))
-                    END), 0) AS net_sales
-                FROM sales_invoice
-                WHERE sales_invoice.company_id = {company_id}
-                  AND sales_invoice.invoice_date >= DATE_FORMAT(CURDATE(), '%Y-%m-01')
-                  AND sales_invoice.invoice_date < CURDATE() + INTERVAL 1 DAY
-                  AND sales_invoice.status NOT IN('draft', 'draft_return', 'canceled')
-            """,
-
-            "net_sales_this_year": """
+            # One template serves every period: the three per-period
+            # variants were byte-identical except for the window, which
+            # is now the structural {date_filter} slot like everywhere
+            # else, so MySQL sees a single statement shape
+            "net_sales": """
                 SELECT COALESCE(
                     SUM(CASE
-                        WHEN sales_invoice.status = 'return' THEN -(sales_invoice.total - COALESCE(sales_invoice.total_tax, 0))
-                        ELSE (sales_invoice.total - COALESCE(sales_invoice.total_tax, 0))
+                        WHEN si.status = 'return' THEN -(si.total - COALESCE(si.total_tax, 0))
+                        ELSE (si.total - COALESCE(si.total_tax, 0))
                     END), 0) AS net_sales
-                FROM sales_invoice
-                WHERE sales_invoice.company_id = {company_id}
-                  AND sales_invoice.invoice_date >= DATE_FORMAT(CURDATE(), '%Y-01-01')
-                  AND sales_invoice.invoice_date < CURDATE() + INTERVAL 1 DAY
-                  AND sales_invoice.status NOT IN('draft', 'draft_return', 'canceled')
+                FROM sales_invoice si
+                WHERE si.company_id = %(company_id)s
+                  AND si.status NOT IN('draft', 'draft_return', 'canceled')
+                  {date_filter}
             """,
 
             # ============================================================================
@@ -176,68 +650,68 @@ class SalesAgent:
             "compare_month": """
                 SELECT
                     COALESCE(SUM(CASE
-                        WHEN sales_invoice.invoice_date >= DATE_FORMAT(CURDATE(), '%Y-%m-01')
-                         AND sales_invoice.invoice_date < CURDATE() + INTERVAL 1 DAY
+                        WHEN sales_invoice.invoice_date >= %(month_start)s
+                         AND sales_invoice.invoice_date < %(day_end)s
                          AND sales_invoice.status NOT IN ('draft', 'draft_return', 'return', 'canceled')
                         THEN sales_invoice.total - COALESCE(sales_invoice.total_tax, 0)
                         ELSE 0
                     END), 0) AS total_sales_this_month,
                     
                     COALESCE(SUM(CASE
-                        WHEN sales_invoice.invoice_date >= DATE_FORMAT(CURDATE() - INTERVAL 1 MONTH, '%Y-%m-01')
-                         AND sales_invoice.invoice_date < DATE_FORMAT(CURDATE(), '%Y-%m-01')
+                        WHEN sales_invoice.invoice_date >= %(last_month_start)s
+                         AND sales_invoice.invoice_date < %(month_start)s
                          AND sales_invoice.status NOT IN ('draft', 'draft_return', 'return', 'canceled')
                         THEN sales_invoice.total - COALESCE(sales_invoice.total_tax, 0)
                         ELSE 0
                     END), 0) AS total_sales_last_month
                 FROM sales_invoice
-                WHERE sales_invoice.company_id = {company_id}
+                WHERE sales_invoice.company_id = %(company_id)s
             """,
 
             "compare_year": """
                 SELECT
                     COALESCE(SUM(CASE
-                        WHEN sales_invoice.invoice_date >= DATE_FORMAT(CURDATE(), '%Y-01-01')
-                         AND sales_invoice.invoice_date < CURDATE() + INTERVAL 1 DAY
+                        WHEN sales_invoice.invoice_date >= %(year_start)s
+                         AND sales_invoice.invoice_date < %(day_end)s
                          AND sales_invoice.status NOT IN ('draft', 'draft_return', 'return', 'canceled')
                         THEN sales_invoice.total - COALESCE(sales_invoice.total_tax, 0)
                         ELSE 0
                     END), 0) AS total_sales_this_year,
                     
                     COALESCE(SUM(CASE
-                        WHEN sales_invoice.invoice_date >= DATE_FORMAT(CURDATE() - INTERVAL 1 YEAR, '%Y-01-01')
-                         AND sales_invoice.invoice_date < DATE_FORMAT(CURDATE(), '%Y-01-01')
+                        WHEN sales_invoice.invoice_date >= %(last_year_start)s
+                         AND sales_invoice.invoice_date < %(year_start)s
                          AND sales_invoice.status NOT IN ('draft', 'draft_return', 'return', 'canceled')
                         THEN sales_invoice.total - COALESCE(sales_invoice.total_tax, 0)
                         ELSE 0
                     END), 0) AS total_sales_last_year
                 FROM sales_invoice
-                WHERE sales_invoice.company_id = {company_id}
+                WHERE sales_invoice.company_id = %(company_id)s
             """,
 
             # ============================================================================
             # DAY EXTREMES & SUMMARY (Document 1)
             # ============================================================================
             "highest_sales_day": """
-                SELECT DATE(invoice_date) AS sales_day,
-                    SUM(total - COALESCE(total_tax, 0)) AS total_sales
-                FROM sales_invoice
-                WHERE company_id = {company_id}
-                  AND status NOT IN ('draft', 'draft_return', 'return', 'canceled')
+                SELECT sales_day,
+                    SUM(net) AS total_sales
+                FROM sales_daily_rollup
+                WHERE company_id = %(company_id)s
+                  AND status_bucket = 'sale'
                   {date_filter}
-                GROUP BY DATE(invoice_date)
+                GROUP BY sales_day
                 ORDER BY total_sales DESC
                 LIMIT 1
             """,
 
             "lowest_sales_day": """
-                SELECT DATE(invoice_date) AS sales_day,
-                    SUM(total - COALESCE(total_tax, 0)) AS total_sales
-                FROM sales_invoice
-                WHERE company_id = {company_id}
-                  AND status NOT IN ('draft', 'draft_return', 'return', 'canceled')
+                SELECT sales_day,
+                    SUM(net) AS total_sales
+                FROM sales_daily_rollup
+                WHERE company_id = %(company_id)s
+                  AND status_bucket = 'sale'
                   {date_filter}
-                GROUP BY DATE(invoice_date)
+                GROUP BY sales_day
                 ORDER BY total_sales ASC
                 LIMIT 1
             """,
@@ -245,7 +719,7 @@ class SalesAgent:
             "total_invoices": """
                 SELECT COUNT(invoice_id) AS total_sales_invoices
                 FROM sales_invoice
-                WHERE company_id = {company_id}
+                WHERE company_id = %(company_id)s
                   AND status NOT IN ('draft', 'draft_return', 'return', 'canceled')
                   {date_filter}
             """,
@@ -254,13 +728,13 @@ class SalesAgent:
             # SALES TREND (Document 1)
             # ============================================================================
             "sales_trend_12_months": """
-                SELECT DATE_FORMAT(invoice_date, '%Y-%m') AS month,
-                    SUM(total - COALESCE(total_tax, 0)) AS total_sales
-                FROM sales_invoice
-                WHERE company_id = {company_id}
-                  AND invoice_date >= DATE_FORMAT(CURDATE() - INTERVAL 11 MONTH, '%Y-%m-01')
-                  AND status NOT IN ('draft', 'draft_return', 'return', 'canceled')
-                GROUP BY DATE_FORMAT(invoice_date, '%Y-%m')
+                SELECT DATE_FORMAT(sales_day, '%Y-%m') AS month,
+                    SUM(net) AS total_sales
+                FROM sales_daily_rollup
+                WHERE company_id = %(company_id)s
+                  AND status_bucket = 'sale'
+                  AND sales_day >= DATE_FORMAT(CURDATE() - INTERVAL 11 MONTH, '%Y-%m-01')
+                GROUP BY DATE_FORMAT(sales_day, '%Y-%m')
                 ORDER BY month ASC
             """,
 
@@ -272,7 +746,7 @@ class SalesAgent:
                     SUM(si.total - COALESCE(si.total_tax, 0)) AS total_sales
                 FROM sales_invoice si
                 JOIN warehouses w ON si.warehouse_id = w.warehouse_id
-                WHERE si.company_id = {company_id}
+                WHERE si.company_id = %(company_id)s
                   AND si.status NOT IN ('draft', 'draft_return', 'return', 'canceled')
                   {date_filter}
                 GROUP BY si.warehouse_id, w.title
@@ -285,7 +759,7 @@ class SalesAgent:
                     SUM(si.total - COALESCE(si.total_tax, 0)) AS total_sales
                 FROM sales_invoice si
                 JOIN warehouses w ON si.warehouse_id = w.warehouse_id
-                WHERE si.company_id = {company_id}
+                WHERE si.company_id = %(company_id)s
                   AND si.status NOT IN ('draft', 'draft_return', 'return', 'canceled')
                   {date_filter}
                 GROUP BY si.warehouse_id, w.title
@@ -298,12 +772,12 @@ class SalesAgent:
                     SUM(si.total - COALESCE(si.total_tax, 0)) AS total_sales
                 FROM sales_invoice si
                 JOIN warehouses w ON si.warehouse_id = w.warehouse_id
-                WHERE si.company_id = {company_id}
+                WHERE si.company_id = %(company_id)s
                   AND si.status NOT IN ('draft', 'draft_return', 'return', 'canceled')
                   {date_filter}
                 GROUP BY si.warehouse_id, w.title
                 ORDER BY total_sales DESC
-                LIMIT {limit}
+                LIMIT %(limit)s
             """,
 
             # ============================================================================
@@ -314,7 +788,7 @@ class SalesAgent:
                     SUM(si.total - COALESCE(si.total_tax, 0)) AS total_sales
                 FROM sales_invoice si
                 LEFT JOIN users u ON si.salesman = u.user_id
-                WHERE si.company_id = {company_id}
+                WHERE si.company_id = %(company_id)s
                   AND si.salesman > 0
                   AND si.status NOT IN ('draft', 'draft_return', 'return', 'canceled')
                   {date_filter}
@@ -327,7 +801,7 @@ class SalesAgent:
                     SUM(si.total - COALESCE(si.total_tax, 0)) AS total_sales
                 FROM sales_invoice si
                 LEFT JOIN users u ON si.salesman = u.user_id
-                WHERE si.company_id = {company_id}
+                WHERE si.company_id = %(company_id)s
                   AND si.salesman > 0
                   AND si.status NOT IN ('draft', 'draft_return', 'return', 'canceled')
                   {date_filter}
@@ -341,7 +815,7 @@ class SalesAgent:
                     SUM(si.total - COALESCE(si.total_tax, 0)) AS total_sales
                 FROM sales_invoice si
                 LEFT JOIN users u ON si.salesman = u.user_id
-                WHERE si.company_id = {company_id}
+                WHERE si.company_id = %(company_id)s
                   AND si.salesman > 0
                   AND si.status NOT IN ('draft', 'draft_return', 'return', 'canceled')
                   {date_filter}
@@ -356,48 +830,43 @@ class SalesAgent:
                     COUNT(si.invoice_id) AS invoice_count
                 FROM sales_invoice si
                 LEFT JOIN users u ON si.salesman = u.user_id
-                WHERE si.company_id = {company_id}
+                WHERE si.company_id = %(company_id)s
                   AND si.salesman > 0
                   AND si.status NOT IN ('draft', 'draft_return', 'return', 'canceled')
                   {date_filter}
                 GROUP BY si.salesman, u.firstname, u.lastname
                 ORDER BY total_sales DESC
-                LIMIT {limit}
+                LIMIT %(limit)s
             """,
 
             # ============================================================================
             # PRODUCT QUERIES - BY QUANTITY (Document 3)
+            # Served from product_daily_rollup (see
+            # database/product_daily_rollup.sql); products/categories are
+            # only joined to resolve names for the top-N rows
             # ============================================================================
             "top_products_by_quantity": """
                 SELECT p.name AS product_name,
-                    SUM(ABS(s.quantity)) AS total_sold_qty
-                FROM stock s
-                JOIN products p ON s.product_id = p.product_id
-                JOIN sales_invoice si ON si.invoice_id = s.invoice_id
-                WHERE s.company_id = {company_id}
-                  AND s.quantity < 0
-                  AND s.stock_type = 'sales'
-                  AND si.status != 'canceled'
+                    SUM(r.qty) AS total_sold_qty
+                FROM product_daily_rollup r
+                JOIN products p ON r.product_id = p.product_id
+                WHERE r.company_id = %(company_id)s
                   {date_filter}
-                GROUP BY s.product_id, p.name
+                GROUP BY r.product_id, p.name
                 ORDER BY total_sold_qty DESC
-                LIMIT {limit}
+                LIMIT %(limit)s
             """,
 
             "slow_moving_products": """
                 SELECT p.name AS product_name,
-                    SUM(ABS(s.quantity)) AS total_sold_qty
-                FROM stock s
-                JOIN products p ON s.product_id = p.product_id
-                JOIN sales_invoice si ON si.invoice_id = s.invoice_id
-                WHERE s.company_id = {company_id}
-                  AND s.quantity < 0
-                  AND s.stock_type = 'sales'
-                  AND si.status != 'canceled'
+                    SUM(r.qty) AS total_sold_qty
+                FROM product_daily_rollup r
+                JOIN products p ON r.product_id = p.product_id
+                WHERE r.company_id = %(company_id)s
                   {date_filter}
-                GROUP BY s.product_id, p.name
+                GROUP BY r.product_id, p.name
                 ORDER BY total_sold_qty ASC
-                LIMIT {limit}
+                LIMIT %(limit)s
             """,
 
             # ============================================================================
@@ -405,55 +874,39 @@ class SalesAgent:
             # ============================================================================
             "highest_sales_category": """
                 SELECT c.title AS category_name,
-                    SUM(ABS(s.quantity)) AS total_sold_qty
-                FROM stock s
-                JOIN products p ON p.product_id = s.product_id
-                JOIN products_category c ON c.category_id = p.category_id
-                JOIN sales_invoice si ON si.invoice_id = s.invoice_id
-                WHERE s.company_id = {company_id}
-                  AND s.stock_type = 'sales'
-                  AND s.quantity < 0
-                  AND si.status != 'canceled'
+                    SUM(r.qty) AS total_sold_qty
+                FROM product_daily_rollup r
+                JOIN products_category c ON c.category_id = r.category_id
+                WHERE r.company_id = %(company_id)s
                   {date_filter}
-                GROUP BY c.category_id, c.title
+                GROUP BY r.category_id, c.title
                 ORDER BY total_sold_qty DESC
                 LIMIT 1
             """,
 
             "lowest_sales_category": """
                 SELECT c.title AS category_name,
-                    SUM(ABS(s.quantity)) AS total_sold_qty
-                FROM stock s
-                JOIN products p ON p.product_id = s.product_id
-                JOIN products_category c ON c.category_id = p.category_id
-                JOIN sales_invoice si ON si.invoice_id = s.invoice_id
-                WHERE s.company_id = {company_id}
-                  AND s.stock_type = 'sales'
-                  AND s.quantity < 0
-                  AND si.status != 'canceled'
+                    SUM(r.qty) AS total_sold_qty
+                FROM product_daily_rollup r
+                JOIN products_category c ON c.category_id = r.category_id
+                WHERE r.company_id = %(company_id)s
                   {date_filter}
-                GROUP BY c.category_id, c.title
+                GROUP BY r.category_id, c.title
                 ORDER BY total_sold_qty ASC
                 LIMIT 1
             """,
 
             "top_categories": """
                 SELECT c.title AS category_name,
-                    SUM(ABS(s.quantity)) AS total_sold_qty,
-                    SUM(ABS(s.quantity) * si_item.price) AS total_revenue
-                FROM stock s
-                JOIN products p ON p.product_id = s.product_id
-                JOIN products_category c ON c.category_id = p.category_id
-                JOIN sales_invoice si ON si.invoice_id = s.invoice_id
-                JOIN sales_items si_item ON si_item.product_id = s.product_id AND si_item.invoice_id = s.invoice_id
-                WHERE s.company_id = {company_id}
-                  AND s.stock_type = 'sales'
-                  AND s.quantity < 0
-                  AND si.status != 'canceled'
+                    SUM(r.qty) AS total_sold_qty,
+                    SUM(r.revenue) AS total_revenue
+                FROM product_daily_rollup r
+                JOIN products_category c ON c.category_id = r.category_id
+                WHERE r.company_id = %(company_id)s
                   {date_filter}
-                GROUP BY c.category_id, c.title
+                GROUP BY r.category_id, c.title
                 ORDER BY total_sold_qty DESC
-                LIMIT {limit}
+                LIMIT %(limit)s
             """,
 
             # ============================================================================
@@ -461,105 +914,75 @@ class SalesAgent:
             # ============================================================================
             "top_products_by_revenue": """
                 SELECT p.name AS product_name,
-                    SUM(ABS(s.quantity) * (si_item.price - si_item.discount)) AS total_revenue
-                FROM stock s
-                JOIN products p ON s.product_id = p.product_id
-                JOIN sales_invoice si ON s.invoice_id = si.invoice_id
-                JOIN sales_items si_item ON si_item.product_id = s.product_id AND si_item.invoice_id = s.invoice_id
-                WHERE s.company_id = {company_id}
-                  AND s.quantity < 0
-                  AND s.stock_type = 'sales'
-                  AND si.status != 'canceled'
+                    SUM(r.revenue) AS total_revenue
+                FROM product_daily_rollup r
+                JOIN products p ON r.product_id = p.product_id
+                WHERE r.company_id = %(company_id)s
                   {date_filter}
-                GROUP BY s.product_id, p.name
+                GROUP BY r.product_id, p.name
                 ORDER BY total_revenue DESC
-                LIMIT {limit}
+                LIMIT %(limit)s
             """,
 
             "highest_revenue_product": """
                 SELECT p.name AS product_name,
-                    SUM(ABS(s.quantity) * (si_item.price - si_item.discount)) AS total_revenue
-                FROM stock s
-                JOIN products p ON s.product_id = p.product_id
-                JOIN sales_invoice si ON s.invoice_id = si.invoice_id
-                JOIN sales_items si_item ON si_item.product_id = s.product_id AND si_item.invoice_id = s.invoice_id
-                WHERE s.company_id = {company_id}
-                  AND s.quantity < 0
-                  AND s.stock_type = 'sales'
-                  AND si.status != 'canceled'
+                    SUM(r.revenue) AS total_revenue
+                FROM product_daily_rollup r
+                JOIN products p ON r.product_id = p.product_id
+                WHERE r.company_id = %(company_id)s
                   {date_filter}
-                GROUP BY s.product_id, p.name
+                GROUP BY r.product_id, p.name
                 ORDER BY total_revenue DESC
                 LIMIT 1
             """,
 
             "lowest_revenue_product": """
                 SELECT p.name AS product_name,
-                    SUM(ABS(s.quantity) * (si_item.price - si_item.discount)) AS total_revenue
-                FROM stock s
-                JOIN products p ON s.product_id = p.product_id
-                JOIN sales_invoice si ON s.invoice_id = si.invoice_id
-                JOIN sales_items si_item ON si_item.product_id = s.product_id AND si_item.invoice_id = s.invoice_id
-                WHERE s.company_id = {company_id}
-                  AND s.quantity < 0
-                  AND s.stock_type = 'sales'
-                  AND si.status != 'canceled'
+                    SUM(r.revenue) AS total_revenue
+                FROM product_daily_rollup r
+                JOIN products p ON r.product_id = p.product_id
+                WHERE r.company_id = %(company_id)s
                   {date_filter}
-                GROUP BY s.product_id, p.name
+                GROUP BY r.product_id, p.name
                 ORDER BY total_revenue ASC
                 LIMIT 1
             """,
 
             "highest_profit_product": """
                 SELECT p.name AS product_name,
-                    SUM(ABS(s.quantity) * ((si_item.price - si_item.discount) - s.cost)) AS total_profit
-                FROM stock s
-                JOIN products p ON s.product_id = p.product_id
-                JOIN sales_invoice si ON s.invoice_id = si.invoice_id
-                JOIN sales_items si_item ON si_item.product_id = s.product_id AND si_item.invoice_id = s.invoice_id
-                WHERE s.company_id = {company_id}
-                  AND s.quantity < 0
-                  AND s.stock_type = 'sales'
-                  AND si.status != 'canceled'
+                    SUM(r.revenue - r.cost_amount) AS total_profit
+                FROM product_daily_rollup r
+                JOIN products p ON r.product_id = p.product_id
+                WHERE r.company_id = %(company_id)s
                   {date_filter}
-                GROUP BY s.product_id, p.name
+                GROUP BY r.product_id, p.name
                 ORDER BY total_profit DESC
                 LIMIT 1
             """,
 
             "lowest_profit_product": """
                 SELECT p.name AS product_name,
-                    SUM(ABS(s.quantity) * ((si_item.price - si_item.discount) - s.cost)) AS total_profit
-                FROM stock s
-                JOIN products p ON s.product_id = p.product_id
-                JOIN sales_invoice si ON s.invoice_id = si.invoice_id
-                JOIN sales_items si_item ON si_item.product_id = s.product_id AND si_item.invoice_id = s.invoice_id
-                WHERE s.company_id = {company_id}
-                  AND s.quantity < 0
-                  AND s.stock_type = 'sales'
-                  AND si.status != 'canceled'
+                    SUM(r.revenue - r.cost_amount) AS total_profit
+                FROM product_daily_rollup r
+                JOIN products p ON r.product_id = p.product_id
+                WHERE r.company_id = %(company_id)s
                   {date_filter}
-                GROUP BY s.product_id, p.name
+                GROUP BY r.product_id, p.name
                 ORDER BY total_profit ASC
                 LIMIT 1
             """,
 
             "top_products_by_profit": """
                 SELECT p.name AS product_name,
-                    SUM(ABS(s.quantity) * ((si_item.price - si_item.discount) - s.cost)) AS total_profit,
-                    SUM(ABS(s.quantity)) AS total_quantity
-                FROM stock s
-                JOIN products p ON s.product_id = p.product_id
-                JOIN sales_invoice si ON s.invoice_id = si.invoice_id
-                JOIN sales_items si_item ON si_item.product_id = s.product_id AND si_item.invoice_id = s.invoice_id
-                WHERE s.company_id = {company_id}
-                  AND s.quantity < 0
-                  AND s.stock_type = 'sales'
-                  AND si.status != 'canceled'
+                    SUM(r.revenue - r.cost_amount) AS total_profit,
+                    SUM(r.qty) AS total_quantity
+                FROM product_daily_rollup r
+                JOIN products p ON r.product_id = p.product_id
+                WHERE r.company_id = %(company_id)s
                   {date_filter}
-                GROUP BY s.product_id, p.name
+                GROUP BY r.product_id, p.name
                 ORDER BY total_profit DESC
-                LIMIT {limit}
+                LIMIT %(limit)s
             """,
 
             # ============================================================================
@@ -570,12 +993,12 @@ class SalesAgent:
                     SUM(si.total - COALESCE(si.total_tax, 0)) AS total_revenue
                 FROM sales_invoice si
                 JOIN contacts c ON c.contact_id = si.customer_id
-                WHERE si.company_id = {company_id}
+                WHERE si.company_id = %(company_id)s
                   AND si.status NOT IN ('draft', 'draft_return', 'return', 'canceled')
                   {date_filter}
                 GROUP BY c.contact_id, c.company
                 ORDER BY total_revenue DESC
-                LIMIT {limit}
+                LIMIT %(limit)s
             """,
 
             "lowest_revenue_customers": """
@@ -583,12 +1006,12 @@ class SalesAgent:
                     SUM(si.total - COALESCE(si.total_tax, 0)) AS total_revenue
                 FROM sales_invoice si
                 JOIN contacts c ON c.contact_id = si.customer_id
-                WHERE si.company_id = {company_id}
+                WHERE si.company_id = %(company_id)s
                   AND si.status NOT IN ('draft', 'draft_return', 'return', 'canceled')
                   {date_filter}
                 GROUP BY c.contact_id, c.company
                 ORDER BY total_revenue ASC
-                LIMIT {limit}
+                LIMIT %(limit)s
             """,
 
             "customer_wise_sales": """
@@ -599,110 +1022,165 @@ class SalesAgent:
                     SUM(si.total - COALESCE(si.total_tax, 0)) AS net_sales
                 FROM sales_invoice si
                 JOIN contacts c ON c.contact_id = si.customer_id
-                WHERE si.company_id = {company_id}
+                WHERE si.company_id = %(company_id)s
                   AND si.status NOT IN ('draft', 'draft_return', 'return', 'canceled')
                   {date_filter}
                 GROUP BY c.contact_id, c.company
                 ORDER BY net_sales DESC
-                LIMIT {limit}
+                LIMIT %(limit)s
             """,
 
-            "inactive_customers_30_days": """
+            # One parameterized template serves every inactivity window;
+            # the 30/60/90-day variants differed only in the INTERVAL
+            # literal, which is now a bound parameter so the server sees a
+            # single statement shape.
+            # NOT EXISTS short-circuits at the first recent invoice per
+            # customer and the scalar MAX resolves as an index seek on
+            # idx_si_company_customer_date_status, replacing the old
+            # double LEFT JOIN that materialized every invoice per
+            # customer before filtering
+            "inactive_customers": """
                 SELECT c.company AS customer_name,
-                    MAX(si_all.invoice_date) AS last_invoice_date
+                    DATE_FORMAT((
+                        SELECT MAX(si_all.invoice_date)
+                        FROM sales_invoice si_all
+                        WHERE si_all.customer_id = c.contact_id
+                          AND si_all.company_id = %(company_id)s
+                          AND si_all.status NOT IN ('draft', 'draft_return', 'return', 'canceled')
+                    ), '%Y-%m-%d') AS last_invoice_date
                 FROM contacts c
-                LEFT JOIN sales_invoice si_recent
-                    ON si_recent.customer_id = c.contact_id
-                    AND si_recent.invoice_date >= CURDATE() - INTERVAL 30 DAY
-                    AND si_recent.status NOT IN ('draft', 'draft_return', 'return', 'canceled')
-                    AND si_recent.company_id = {company_id}
-                LEFT JOIN sales_invoice si_all
-                    ON si_all.customer_id = c.contact_id
-                    AND si_all.status NOT IN ('draft', 'draft_return', 'return', 'canceled')
-                    AND si_all.company_id = {company_id}
-                WHERE c.company_id = {company_id}
+                WHERE c.company_id = %(company_id)s
                   AND c.is_active = 1
-                  AND si_recent.invoice_id IS NULL
-                GROUP BY c.contact_id, c.company
-                HAVING MAX(si_all.invoice_date) IS NOT NULL
+                  AND NOT EXISTS (
+                      SELECT 1
+                      FROM sales_invoice si_recent
+                      WHERE si_recent.customer_id = c.contact_id
+                        AND si_recent.company_id = %(company_id)s
+                        AND si_recent.invoice_date >= %(day_start)s - INTERVAL %(days)s DAY
+                        AND si_recent.status NOT IN ('draft', 'draft_return', 'return', 'canceled')
+                  )
+                HAVING last_invoice_date IS NOT NULL
                 ORDER BY last_invoice_date DESC
-                LIMIT {limit}
+                LIMIT %(limit)s
             """,
-
-            "inactive_customers_60_days": """
-                SELECT c.company AS customer_name,
-                    MAX(si_all.invoice_date) AS last_invoice_date
-                FROM contacts c
-                LEFT JOIN sales_invoice si_recent
-                    ON si_recent.customer_id = c.contact_id
-                    AND si_recent.invoice_date >= CURDATE() - INTERVAL 60 DAY
-                    AND si_recent.status NOT IN ('draft', 'draft_return', 'return', 'canceled')
-                    AND si_recent.company_id = {company_id}
-                LEFT JOIN sales_invoice si_all
-                    ON si_all.customer_id = c.contact_id
-                    AND si_all.status NOT IN ('draft', 'draft_return', 'return', 'canceled')
-                    AND si_all.company_id = {company_id}
-                WHERE c.company_id = {company_id}
-                  AND c.is_active = 1
-                  AND si_recent.invoice_id IS NULL
-                GROUP BY c.contact_id, c.company
-                HAVING MAX(si_all.invoice_date) IS NOT NULL
-                ORDER BY last_invoice_date DESC
-                LIMIT {limit}
-            """,
-
-            "inactive_customers_90_days": """
-                SELECT c.company AS customer_name,
-                    MAX(si_all.invoice_date) AS last_invoice_date
-                FROM contacts c
-                LEFT JOIN sales_invoice si_recent
-                    ON si_recent.customer_id = c.contact_id
-                    AND si_recent.invoice_date >= CURDATE() - INTERVAL 90 DAY
-                    AND si_recent.status NOT IN ('draft', 'draft_return', 'return', 'canceled')
-                    AND si_recent.company_id = {company_id}
-                LEFT JOIN sales_invoice si_all
-                    ON si_all.customer_id = c.contact_id
-                    AND si_all.status NOT IN ('draft', 'draft_return', 'return', 'canceled')
-                    AND si_all.company_id = {company_id}
-                WHERE c.company_id = {company_id}
-                  AND c.is_active = 1
-                  AND si_recent.invoice_id IS NULL
-                GROUP BY c.contact_id, c.company
-                HAVING MAX(si_all.invoice_date) IS NOT NULL
-                ORDER BY last_invoice_date DESC
-                LIMIT {limit}
-            """,
-        }
-
-    def _classify_intent(self, message):
-        """Use LLM to classify user intent and extract parameters"""
-
-        # List all available query types
-        available_queries = list(self.query_templates.keys())
-
-        prompt = f"""Analyze this sales query and classify the intent.
-
-USER QUERY: "{message}"
+}
+
+# Pre-compile each template into a string.Template so the hot path does a
+# cheap placeholder substitution instead of re-parsing the format string
+# (and the dict is no longer rebuilt on every SalesAgent() construction,
+# which Streamlit triggers on each rerun).
+# Only the structural {date_filter} slot is substituted into the SQL text;
+# company_id, limit and the date-window bounds are bound driver-side so the
+# statement text stays stable for MySQL's prepared-statement/plan cache
+# (and the format-string injection surface is gone).
+_COMPILED_TEMPLATES = {
+    name: Template(
+        textwrap.dedent(sql).replace('{date_filter}', '$date_filter')
+    )
+    for name, sql in _QUERY_TEMPLATES.items()
+}
+
+
+# ============================================================================
+# KEYWORD SCORER (local fallback classifier)
+# ============================================================================
+# Second local rung between the regex router and Groq: score each template
+# by token overlap between the message and the template's own name. Routes
+# only when the best score is high and unambiguous; everything else still
+# goes to the LLM. Runs in microseconds with no model artifact to ship.
+_SCORER_SKIP_TOKENS = frozenset(['by', 'this', 'wise'])
+
+_INTENT_TOKENS = {
+    name: frozenset(name.split('_')) - _SCORER_SKIP_TOKENS
+    for name in _QUERY_TEMPLATES
+    if name not in ('dashboard_summary', 'sales_year_sealed')
+}
+
+
+def _score_route(msg):
+    """
+    Classify by token overlap with template names
+
+    Expects msg already lowercased with whitespace collapsed.
+
+    Returns:
+        An Intent when one template clearly dominates (score >= 0.6 with
+        a margin over the runner-up), else None for the LLM.
+    """
+    tokens = set(msg.split()) - _STOP_WORDS
+    if not tokens:
+        return None
+
+    best_name, best, second = None, 0.0, 0.0
+    for name, name_tokens in _INTENT_TOKENS.items():
+        overlap = len(tokens & name_tokens)
+        if not overlap:
+            continue
+        score = overlap / len(name_tokens)
+        if score > best:
+            best_name, second, best = name, best, score
+        elif score > second:
+            second = score
+
+    if best_name is None or best < 0.6 or best - second < 0.2:
+        return None
+
+    top_n = _TOP_N_RE.search(msg)
+    days_match = _DAYS_RE.search(msg)
+    return Intent(
+        query_type=best_name,
+        time_period=_detect_time_period(msg),
+        limit=int(top_n.group(1)) if top_n else (20 if 'inactive' in best_name else 10),
+        days=int(days_match.group(1)) if days_match else 30,
+        confidence=best,
+    )
+
+
+@lru_cache(maxsize=256)
+def _materialize_sql(query_type, date_filter):
+    """
+    Specialize a compiled template down to final SQL text
+
+    date_filter is the only textual substitution left (everything else is
+    driver-bound), and its fragments are themselves memoized per day, so
+    each (template, period) pair pays the substitution walk exactly once
+    per day instead of on every request.
+    """
+    return _COMPILED_TEMPLATES[query_type].safe_substitute(date_filter=date_filter)
+
+
+# Classification prompt assembled once at import: the query-type list is
+# static, so serializing it (and rebuilding the surrounding instructions)
+# per call was pure waste. string.Template sidesteps brace-escaping in the
+# embedded JSON example; only $message varies per turn.
+_AVAILABLE_QUERIES_JSON = json.dumps(list(_QUERY_TEMPLATES), indent=2)
+
+# Classification instructions live entirely in the system message: Groq's
+# prefix cache only applies to a byte-identical leading block, so the
+# static bulk (query list, JSON shape, matching rules) goes first and the
+# per-turn user message carries nothing but the question. This skips
+# re-encoding ~2 KB of instruction tokens on every classification.
+_CLASSIFY_SYSTEM_PROMPT = ("""Analyze the user's sales query and classify the intent.
 
 AVAILABLE QUERY TYPES (choose the most specific one):
-{json.dumps(available_queries, indent=2)}
+""" + _AVAILABLE_QUERIES_JSON + """
 
 Extract and return ONLY a JSON object:
-{{
+{
     "query_type": "<one of the available query types>",
     "time_period": "<today|this_month|this_year|last_X_days|all_time>",
     "limit": <number if specified like "top 5", "top 10", otherwise 10 or 20 for inactive customers>,
     "days": <number of days if applicable>,
     "confidence": <0.0 to 1.0>
-}}
+}
 
 CRITICAL MATCHING RULES (MUST FOLLOW):
-- "haven't bought" / "haven't purchased" / "not bought" / "not purchased" / "inactive" → inactive_customers_XX_days
-- "customers who haven't bought in a month" → inactive_customers_30_days (limit=20, days=30)
-- "customers who haven't bought in 60 days" → inactive_customers_60_days (limit=20, days=60)
-- "customers who haven't bought in 90 days" → inactive_customers_90_days (limit=20, days=90)
+- "haven't bought" / "haven't purchased" / "not bought" / "not purchased" / "inactive" → inactive_customers
+- "customers who haven't bought in a month" → inactive_customers (limit=20, days=30)
+- "customers who haven't bought in 60 days" → inactive_customers (limit=20, days=60)
+- "customers who haven't bought in 90 days" → inactive_customers (limit=20, days=90)
 - "returns today" → returns_today
-- "sales this month" → sales_this_month  
+- "sales this month" → sales_this_month
 - "top 5 products by value/revenue/money" → top_products_by_revenue (limit=5)
 - "top products by quantity/units sold" → top_products_by_quantity
 - "most profitable products" → top_products_by_profit
@@ -711,129 +1189,669 @@ CRITICAL MATCHING RULES (MUST FOLLOW):
 - "worst branch" → lowest_sales_branch
 - "sales trend" → sales_trend_12_months
 - "compare this month vs last month" → compare_month
-- "net sales" → net_sales_[period]
+- "net sales" → net_sales (set time_period to the mentioned period)
 - "customer-wise sales" / "sales by customer" → customer_wise_sales
 
 IMPORTANT: If query mentions "haven't", "not purchased", "inactive", it's about INACTIVE CUSTOMERS, not customer_wise_sales!
 
-Return ONLY the JSON, no other text."""
+Return ONLY the JSON, no other text.""")
+
+# ============================================================================
+# FALLBACK FORMATTER FIELD KINDS
+# ============================================================================
+# Column-name keyword groups for _basic_format, hoisted so the per-cell
+# any() probes don't rebuild list literals; each distinct column name is
+# classified once and reused across rows and result sets.
+_BASIC_MONEY_KEYS = ('revenue', 'sales', 'total', 'amount', 'price', 'cost', 'profit')
+_BASIC_QTY_KEYS = ('quantity', 'qty', 'units', 'sold')
+_BASIC_COUNT_KEYS = ('count', 'invoices', 'orders', 'customers')
+
+
+@lru_cache(maxsize=256)
+def _basic_field_kind(key_l):
+    """Classify a result column by its lowercased name"""
+    if any(keyword in key_l for keyword in _BASIC_MONEY_KEYS):
+        return 'money'
+    if any(keyword in key_l for keyword in _BASIC_QTY_KEYS):
+        return 'qty'
+    if any(keyword in key_l for keyword in _BASIC_COUNT_KEYS):
+        return 'count'
+    if 'percent' in key_l or 'pct' in key_l:
+        return 'percent'
+    if 'date' in key_l:
+        return 'date'
+    return 'other'
+
+
+# Per-kind formatting closures; the row loops dispatch through these
+# instead of re-walking an if/elif ladder for every cell
+_BASIC_SUMMARY_FORMATTERS = {
+    'money': lambda key, value: f"💰 **{key}:** ${value:,.2f}\n",
+    'qty': lambda key, value: f"📦 **{key}:** {int(value):,} units\n",
+    'count': lambda key, value: f"📊 **{key}:** {int(value):,}\n",
+    'percent': lambda key, value: f"📈 **{key}:** {value:.2f}%\n",
+    'date': lambda key, value: f"**{key}:** {value:,.2f}\n",
+    'other': lambda key, value: f"**{key}:** {value:,.2f}\n",
+}
+
+_BASIC_CELL_FORMATTERS = {
+    'money': lambda value: f"${value:,.2f}",
+    'qty': lambda value: f"{int(value):,} units",
+    'count': lambda value: f"{int(value):,}",
+    'percent': lambda value: f"{value:.2f}%",
+    'date': lambda value: f"{value:,.2f}",
+    'other': lambda value: f"{value:,.2f}",
+}
+
+
+class SalesAgent:
+    """Complete hybrid approach with all documented queries"""
+
+    def __init__(self):
+        # Initialize Groq
+        self.api_key = st.secrets["GROQ_API_KEY"]
+        if not self.api_key:
+            raise ValueError("GROQ_API_KEY not found in environment variables")
+
+        self.api_url = "https://api.groq.com/openai/v1/chat/completions"
+        self.model = "llama-3.1-8b-instant"
 
+        # Built once; set on the shared session so requests doesn't
+        # re-merge per-call header dicts (the httpx path passes them
+        # explicitly since the async client is created per batch)
+        self.headers = {
+            "Authorization": f"Bearer {self.api_key}",
+            "Content-Type": "application/json"
+        }
+        _SESSION.headers.update(self.headers)
+
+        # All hardcoded query templates (module-level, compiled at import)
+        self.query_templates = _QUERY_TEMPLATES
+
+        # Parsed-intent cache: the Groq response cache above still pays
+        # prompt build + JSON extraction on every repeat; this skips both.
+        # Keyed by the canonicalized message; hits return a shallow copy so
+        # callers can't mutate the cached entry.
+        self._intent_cache = LRUCache(maxsize=512)
+
+        # Formatted-output cache: identical result sets produce identical
+        # summaries, so repeats skip the formatting LLM call entirely
+        self._format_cache = LRUCache(maxsize=256)
+        self._memo_lock = threading.Lock()
+
+    @staticmethod
+    def _consume_stream(response, stop_at_json=False):
+        """
+        Accumulate SSE delta chunks into the full response text
+
+        With stop_at_json=True, reading stops the moment a balanced
+        {...} object has arrived: the intent JSON is ~100 bytes, so the
+        stream is closed instead of waiting out trailing prose or
+        whitespace the model appends after it.
+        """
+        parts = []
+        depth = 0
+        seen_brace = False
         try:
-            response = self._call_groq(prompt, max_tokens=500)
-            response = response.strip()
-            response = re.sub(r'^```json\s*', '', response)
-            response = re.sub(r'\s*```$', '', response)
+            for line in response.iter_lines():
+                if not line or not line.startswith(b'data: '):
+                    continue
+                payload = line[6:]
+                if payload == b'[DONE]':
+                    break
+                delta = orjson.loads(payload)['choices'][0].get('delta', {}).get('content')
+                if not delta:
+                    continue
+                parts.append(delta)
+                if stop_at_json:
+                    for char in delta:
+                        if char == '{':
+                            depth += 1
+                            seen_brace = True
+                        elif char == '}':
+                            depth -= 1
+                    if seen_brace and depth <= 0:
+                        break
+        finally:
+            response.close()
+        return ''.join(parts).strip()
+
+    def _call_groq(self, prompt, max_tokens=800, temperature=0.1,
+                   stream=False, stop_at_json=False, system_prompt=_SYSTEM_PROMPT):
+        """Call Groq API (cached by canonicalized prompt)"""
+        cache_key = (_canonicalize_prompt(prompt), system_prompt, self.model,
+                     max_tokens, temperature)
+        with _INTENT_CACHE_LOCK:
+            cached = _INTENT_CACHE.get(cache_key)
+        if cached is not None:
+            return cached
 
-            intent = json.loads(response)
+        data = {
+            "model": self.model,
+            "messages": [
+                {
+                    "role": "system",
+                    "content": system_prompt
+                },
+                {
+                    "role": "user",
+                    "content": prompt
+                }
+            ],
+            "max_tokens": max_tokens,
+            "temperature": temperature
+        }
 
-            if intent.get('query_type') not in self.query_templates:
-                print(f"⚠️ Unknown query type: {intent.get('query_type')}, defaulting")
-                intent['query_type'] = 'sales_this_month'
+        # Coalesce concurrent identical prompts into one API call
+        flight, leader = _join_flight(_GROQ_INFLIGHT, cache_key)
+        if not leader:
+            return flight.result()
 
-            # Set defaults based on query type
-            if 'inactive_customers' in intent.get('query_type', ''):
-                intent.setdefault('limit', 20)  # More results for inactive customers
+        try:
+            # Respect the RPM budget before spending a round-trip; cache
+            # hits and joined flights above never reach this point
+            _RATE_LIMITER.acquire()
+
+            if stream:
+                # SSE path: tokens arrive as they're generated, so short
+                # answers finish at first-token latency instead of
+                # full-body latency
+                data["stream"] = True
+                response = _SESSION.post(
+                    self.api_url, data=orjson.dumps(data), timeout=30, stream=True
+                )
+                response.raise_for_status()
+                content = self._consume_stream(response, stop_at_json=stop_at_json)
             else:
-                intent.setdefault('limit', 10)
+                response = _SESSION.post(self.api_url, data=orjson.dumps(data), timeout=30)
+                response.raise_for_status()
+                result = orjson.loads(response.content)
 
-            intent.setdefault('days', 30)
-            intent.setdefault('confidence', 0.0)
+                if 'choices' not in result or len(result['choices']) == 0:
+                    raise Exception(f"Invalid response structure: {result}")
 
+                content = result['choices'][0]['message']['content'].strip()
+            with _INTENT_CACHE_LOCK:
+                _INTENT_CACHE[cache_key] = content
+            flight.set_result(content)
+            return content
+
+        except requests.exceptions.RequestException as e:
+            # A 429 that slipped through means the local budget is out of
+            # step with the server's; drain the bucket per its hint
+            error_response = getattr(e, 'response', None)
+            if error_response is not None and error_response.status_code == 429:
+                retry_after = error_response.headers.get('Retry-After')
+                _RATE_LIMITER.penalize(float(retry_after) if retry_after else 2.0)
+            flight.set_exception(Exception(f"Failed to get response from Groq: {str(e)}"))
+            _LOG.error("Groq API Error: %s", e)
+            raise Exception(f"Failed to get response from Groq: {str(e)}")
+        except BaseException as e:
+            flight.set_exception(e)
+            raise
+        finally:
+            _release_flight(_GROQ_INFLIGHT, cache_key)
+
+    async def _call_groq_async(self, client, prompt, max_tokens=800,
+                               temperature=0.1, system_prompt=_SYSTEM_PROMPT):
+        """Async twin of _call_groq for concurrent dispatch"""
+        data = {
+            "model": self.model,
+            "messages": [
+                {
+                    "role": "system",
+                    "content": system_prompt
+                },
+                {
+                    "role": "user",
+                    "content": prompt
+                }
+            ],
+            "max_tokens": max_tokens,
+            "temperature": temperature
+        }
+
+        response = await client.post(self.api_url, headers=self.headers, content=orjson.dumps(data))
+        response.raise_for_status()
+        result = orjson.loads(response.content)
+
+        if 'choices' not in result or len(result['choices']) == 0:
+            raise Exception(f"Invalid response structure: {result}")
+
+        return result['choices'][0]['message']['content'].strip()
+
+    def _call_groq_many(self, prompts, max_tokens=800, temperature=0.1):
+        """
+        Run several Groq calls concurrently
+
+        N classifications complete in roughly one round-trip of wall time
+        instead of N sequential round-trips.
+
+        Returns:
+            List of response strings, in the same order as prompts
+        """
+        async def _gather():
+            semaphore = asyncio.Semaphore(8)
+            limits = httpx.Limits(max_connections=20)
+            async with httpx.AsyncClient(timeout=30, limits=limits) as client:
+                async def _one(prompt):
+                    async with semaphore:
+                        return await self._call_groq_async(
+                            client, prompt, max_tokens, temperature
+                        )
+                return await asyncio.gather(*[_one(p) for p in prompts])
+
+        return asyncio.run(_gather())
+
+    def _call_groq_batch(self, prompts, max_tokens=800, temperature=0.1,
+                         system_prompt=_SYSTEM_PROMPT):
+        """
+        Pack several prompts into a single Groq request
+
+        One request spends 1/N of the RPM budget compared to fanning out
+        N calls, and the shared system prefix is tokenized once. The
+        model is asked for a JSON array with one answer per question, in
+        order; if the response doesn't parse into exactly N entries the
+        batch degrades to the concurrent per-prompt path.
+
+        Returns:
+            List of response strings, in the same order as prompts
+        """
+        if not prompts:
+            return []
+        if len(prompts) == 1:
+            return [self._call_groq(prompts[0], max_tokens, temperature,
+                                    system_prompt=system_prompt)]
+
+        batch_prompt = (
+            "Answer each of the following questions independently. Return "
+            "ONLY a JSON array of strings, one answer per question, in the "
+            "same order. No other text.\n\n"
+            + "\n".join(f"{i}. {prompt}" for i, prompt in enumerate(prompts, 1))
+        )
+
+        try:
+            response = self._call_groq(
+                batch_prompt, max_tokens=max_tokens * len(prompts),
+                temperature=temperature, system_prompt=system_prompt
+            )
+            answers = _loads_lenient(_CODE_FENCE_RE.sub('', response.strip()))
+            if isinstance(answers, list) and len(answers) == len(prompts):
+                return [str(answer).strip() for answer in answers]
+            _LOG.warning("⚠️ Batched response shape mismatch for %d prompts",
+                         len(prompts))
+        except Exception as e:
+            _LOG.warning("⚠️ Batched Groq call failed, falling back: %s", e)
+
+        return self._call_groq_many(prompts, max_tokens, temperature)
+
+    def _classify_intent(self, message):
+        """Use LLM to classify user intent and extract parameters"""
+
+        # Lowercase and collapse whitespace exactly once; every matcher
+        # below (cache key, regex router, keyword scorer) shares the buffer
+        norm_msg = _WHITESPACE_RE.sub(' ', message.strip().lower())
+
+        # Repeat questions skip classification entirely (router and LLM).
+        # Intents are frozen, so cached instances are shared as-is.
+        intent_key = _strip_stop_words(norm_msg)
+        with self._memo_lock:
+            cached_intent = self._intent_cache.get(intent_key)
+        if cached_intent is not None:
+            _LOG.info("⚡ Intent cache hit: %s", cached_intent.query_type)
+            return cached_intent
+
+        # Try the regex fast router first; the LLM only sees messages it
+        # can't resolve
+        fast_intent = _fast_route(norm_msg)
+        if fast_intent is not None:
+            _LOG.info("⚡ Fast route: %s", fast_intent.query_type)
+            with self._memo_lock:
+                self._intent_cache[intent_key] = fast_intent
+            return fast_intent
+
+        # Second local rung: unambiguous token-overlap matches also skip
+        # the network; anything borderline still goes to the LLM
+        scored_intent = _score_route(norm_msg)
+        if scored_intent is not None:
+            _LOG.info("⚡ Keyword route: %s", scored_intent.query_type)
+            with self._memo_lock:
+                self._intent_cache[intent_key] = scored_intent
+            return scored_intent
+
+        # LLM-bound cold path: the Groq round-trip takes hundreds of ms,
+        # so warm a DB connection in parallel — by the time the intent
+        # arrives, the execute step checks out a live connection for free
+        _EXECUTOR.submit(_warm_db_pool)
+
+        # Static instructions ride in the (prefix-cacheable) system
+        # message; the user turn is just the question
+        prompt = f'USER QUERY: "{message}"'
+
+        try:
+            # Stream and cut off at the first balanced JSON object; the
+            # intent payload is tiny so this returns at ~first-token time
+            response = self._call_groq(
+                prompt, max_tokens=500, stream=True, stop_at_json=True,
+                system_prompt=_CLASSIFY_SYSTEM_PROMPT
+            )
+            response = _CODE_FENCE_RE.sub('', response.strip())
+
+            # Extract the JSON object even if the model added prose around it
+            json_match = _JSON_BLOCK_RE.search(response)
+            raw = _loads_lenient(json_match.group(0) if json_match else response)
+
+            query_type = raw.get('query_type') or ''
+
+            # Normalize the retired per-window names the model may still emit
+            legacy = _LEGACY_INACTIVE_RE.match(query_type)
+            if legacy:
+                query_type = 'inactive_customers'
+                raw.setdefault('days', int(legacy.group(1)))
+
+            legacy_net = _LEGACY_NET_SALES_RE.match(query_type)
+            if legacy_net:
+                query_type = 'net_sales'
+                raw.setdefault('time_period', legacy_net.group(1))
+
+            if query_type not in self.query_templates:
+                _LOG.warning("⚠️ Unknown query type: %s, defaulting", query_type)
+                query_type = 'sales_this_month'
+
+            # More results for inactive customers by default
+            default_limit = 20 if 'inactive_customers' in query_type else 10
+            intent = Intent(
+                query_type=query_type,
+                time_period=raw.get('time_period') or 'all_time',
+                limit=int(raw.get('limit') or default_limit),
+                days=int(raw.get('days') or 30),
+                confidence=float(raw.get('confidence') or 0.0),
+            )
+
+            with self._memo_lock:
+                self._intent_cache[intent_key] = intent
             return intent
 
         except Exception as e:
-            print(f"Error classifying intent: {e}")
-            return {
-                "query_type": "sales_this_month",
-                "time_period": "this_month",
-                "limit": 10,
-                "days": 30,
-                "confidence": 0.0
-            }
+            _LOG.error("Error classifying intent: %s", e)
+            return Intent(query_type="sales_this_month", time_period="this_month")
+
+    def _execute_template(self, query_type, **params):
+        """
+        Format a query template and execute it through the result cache
+
+        Returns:
+            Tuple of (result rows, formatted SQL string)
+        """
+        sql_query = _materialize_sql(query_type, params.get('date_filter', ''))
+
+        # Everything except the structural date_filter fragment is bound
+        # driver-side: company_id/limit plus the date-window boundaries
+        query_params = None
+        if '%(' in sql_query:
+            query_params = dict(_today_bounds())
+            for key, value in params.items():
+                if key == 'date_filter':
+                    continue
+                query_params[key] = int(value) if key in ('company_id', 'limit') else value
+
+        tier = _result_cache_tier(query_type)
+        cache = _RESULT_CACHES[tier]
+        today_key = date.today().isoformat()
+        cache_key = (query_type, tuple(sorted(params.items())), today_key)
+
+        with _RESULT_CACHE_LOCK:
+            cached = cache.get(cache_key)
+        if cached is not None:
+            _LOG.info("⚡ Result cache hit: %s", query_type)
+            return copy.deepcopy(cached), sql_query
+
+        # L2: shared Redis cache (if configured)
+        redis_client = _get_redis()
+        redis_key = None
+        if redis_client is not None:
+            params_hash = hashlib.md5(repr(sorted(params.items())).encode()).hexdigest()
+            redis_key = (
+                f"salesagent:v1:{query_type}:{params.get('company_id')}:"
+                f"{params_hash}:{today_key}"
+            )
+            try:
+                l2_value = redis_client.get(redis_key)
+            except Exception:
+                l2_value = None
+            if l2_value is not None:
+                result = orjson.loads(l2_value)
+                _LOG.info("⚡ L2 cache hit: %s", query_type)
+                with _RESULT_CACHE_LOCK:
+                    cache[cache_key] = copy.deepcopy(result)
+                return result, sql_query
+
+        # Coalesce concurrent cold-cache duplicates into one DB round-trip
+        flight, leader = _join_flight(_SQL_INFLIGHT, cache_key)
+        if not leader:
+            return copy.deepcopy(flight.result()), sql_query
+
+        try:
+            # Top-N templates fetch at most their limit; scalar templates
+            # keep the default buffered path
+            max_rows = int(params['limit']) if 'limit' in params else None
+            result = db.execute_query(sql_query, query_params, max_rows=max_rows)
+
+            if result is not None:
+                with _RESULT_CACHE_LOCK:
+                    cache[cache_key] = copy.deepcopy(result)
+                if redis_key is not None:
+                    try:
+                        redis_client.setex(
+                            redis_key, _REDIS_TTLS[tier],
+                            orjson.dumps(result, default=str)
+                        )
+                    except Exception:
+                        pass  # L2 is best-effort
+
+            flight.set_result(result)
+            return result, sql_query
+        except BaseException as e:
+            flight.set_exception(e)
+            raise
+        finally:
+            _release_flight(_SQL_INFLIGHT, cache_key)
+
+    def _execute_template_df(self, query_type, **params):
+        """
+        Execute a list-style template and return a pandas DataFrame
+
+        Row-heavy results (trend, top-N, customer-wise) go straight into
+        one columnar frame that st.dataframe/st.line_chart can render
+        without the UI layer iterating per-row dicts.
+
+        Returns:
+            Tuple of (DataFrame, formatted SQL string)
+        """
+        rows, sql_query = self._execute_template(query_type, **params)
+        frame = pd.DataFrame(rows) if rows else pd.DataFrame()
+        return frame, sql_query
+
+    def _sales_year_to_date(self, company_id):
+        """
+        Year-to-date sales as sealed history + today's fragment
+
+        Days before today never change, so the sealed rollup sum stays
+        cached until midnight; only today's invoices are scanned live.
+
+        Returns:
+            Tuple of (result rows, SQL shown to the user)
+        """
+        sealed_rows, sealed_sql = self._execute_template(
+            'sales_year_sealed', company_id=company_id
+        )
+        today_rows, today_sql = self._execute_template(
+            'sales_today', company_id=company_id
+        )
+
+        sealed = (sealed_rows or [{}])[0].get('total_sales') or 0
+        today_total = (today_rows or [{}])[0].get('total_sales') or 0
+
+        result = [{'total_sales': float(sealed) + float(today_total)}]
+        combined_sql = f"-- sealed history\n{sealed_sql.strip()}\n\n-- today\n{today_sql.strip()}"
+        return result, combined_sql
+
+    def _execute_many(self, specs):
+        """
+        Execute independent template queries concurrently
+
+        Wall time drops to max(query_i) instead of sum(query_i) for
+        compound flows like a today/returns/net dashboard.
+
+        Args:
+            specs: Dict of {query_type: params dict}
+
+        Returns:
+            Dict of {query_type: (result rows, formatted SQL string)}
+        """
+        futures = {
+            name: _EXECUTOR.submit(self._execute_template, name, **params)
+            for name, params in specs.items()
+        }
+        return {name: future.result() for name, future in futures.items()}
 
     def _get_date_filter(self, time_period):
-        """Generate date filter SQL fragment"""
-        if time_period == "today":
-            return "AND si.invoice_date >= CURDATE() AND si.invoice_date < CURDATE() + INTERVAL 1 DAY"
-        elif time_period == "this_month":
-            return "AND si.invoice_date >= DATE_FORMAT(CURDATE(), '%Y-%m-01') AND si.invoice_date < CURDATE() + INTERVAL 1 DAY"
-        elif time_period == "this_year":
-            return "AND si.invoice_date >= DATE_FORMAT(CURDATE(), '%Y-01-01') AND si.invoice_date < CURDATE() + INTERVAL 1 DAY"
-        elif time_period.startswith("last_"):
-            days = time_period.replace("last_", "").replace("_days", "")
-            return f"AND si.invoice_date >= CURDATE() - INTERVAL {days} DAY"
-        else:
-            return ""
+        """Generate date filter SQL fragment (memoized per period + day)"""
+        return _date_filter_fragment(time_period, date.today().isoformat(), 'si.invoice_date')
+
+    def _get_rollup_date_filter(self, time_period):
+        """Date filter fragment for templates that read the daily rollups"""
+        return _date_filter_fragment(time_period, date.today().isoformat(), 'sales_day')
 
     def _get_date_label(self, time_period):
-        """Get human-readable label"""
-        labels = {
-            "today": "Today",
-            "this_month": "This Month",
-            "this_year": "This Year",
-            "last_30_days": "Last 30 Days",
-            "last_60_days": "Last 60 Days",
-            "last_90_days": "Last 90 Days",
-            "all_time": "All Time"
-        }
-        return labels.get(time_period, time_period.replace("_", " ").title())
+        """Get human-readable label (precomputed; open-ended values interned)"""
+        return _date_label(time_period)
 
     def process_query(self, message, company_id):
         """Main query processor"""
+        response_key = (
+            str(company_id), _canonicalize_prompt(message),
+            date.today().isoformat()
+        )
+        with _RESPONSE_CACHE_LOCK:
+            cached_response = _RESPONSE_CACHE.get(response_key)
+        if cached_response is not None:
+            _LOG.info("⚡ Response cache hit: %s", message[:50])
+            return cached_response
+
         try:
             # Step 1: LLM classifies intent
             intent = self._classify_intent(message)
-            print(f"🎯 Intent: {json.dumps(intent, indent=2)}")
+            if _LOG.isEnabledFor(logging.DEBUG):
+                _LOG.debug("🎯 Intent: %s", intent)
 
-            # Step 2: Get hardcoded SQL template
-            query_type = intent['query_type']
-            sql_template = self.query_templates[query_type]
+            # Step 2: Resolve query type
+            query_type = intent.query_type
 
-            # Step 3: Build date filter
-            date_filter = self._get_date_filter(intent['time_period'])
-
-            # Step 4: Format SQL with parameters
-            sql_query = sql_template.format(
-                company_id=company_id,
-                limit=intent['limit'],
-                days=intent['days'],
-                date_filter=date_filter
-            )
-
-            print(f"📝 Query type: {query_type}")
-            print(f"🔍 SQL:\n{sql_query.strip()}")
+            # Step 3: Build date filter (rollup-backed templates filter on
+            # sales_day instead of invoice_date)
+            if query_type in _ROLLUP_TEMPLATES:
+                date_filter = self._get_rollup_date_filter(intent.time_period)
+            else:
+                date_filter = self._get_date_filter(intent.time_period)
 
-            # Step 5: Execute
-            result = db.execute_query(sql_query, ())
+            # Step 4 & 5: Format SQL and execute (cached per template + params + day)
+            if query_type == 'sales_this_year':
+                # Incremental: sealed rollup history + a live scan of today
+                result, sql_query = self._sales_year_to_date(company_id)
+            else:
+                result, sql_query = self._execute_template(
+                    query_type,
+                    company_id=company_id,
+                    limit=intent.limit,
+                    days=intent.days,
+                    date_filter=date_filter
+                )
+
+            _LOG.info("📝 Query type: %s", query_type)
+            if _LOG.isEnabledFor(logging.DEBUG):
+                _LOG.debug("🔍 SQL:\n%s", sql_query.strip())
 
             # Step 6: Format results
-            date_label = self._get_date_label(intent['time_period'])
+            date_label = self._get_date_label(intent.time_period)
             formatted_response = self._format_results(
                 message, result, {'label': date_label}, query_type
             )
 
-            # Add transparency
-            formatted_response += f"\n\n---\n**🎯 Query Type:** `{query_type}`"
-            formatted_response += f"\n**📊 Limit:** {intent['limit']}"
-            formatted_response += f"\n**🔍 Confidence:** {intent['confidence']:.0%}"
-            formatted_response += f"\n\n**SQL:**\n```sql\n{sql_query.strip()}\n```"
+            # Transparency block is debug-only: echoing the SQL appends
+            # up to ~1.5KB to every payload the UI then re-markdowns
+            if os.getenv('SALES_AGENT_DEBUG') == '1':
+                formatted_response += "\n".join([
+                    "\n\n---",
+                    f"**🎯 Query Type:** `{query_type}`",
+                    f"**📊 Limit:** {intent.limit}",
+                    f"**🔍 Confidence:** {intent.confidence:.0%}",
+                    f"\n**SQL:**\n```sql\n{sql_query.strip()}\n```",
+                ])
+
+            with _RESPONSE_CACHE_LOCK:
+                _RESPONSE_CACHE[response_key] = formatted_response
 
             return formatted_response
 
         except Exception as e:
-            print(f"❌ Error: {e}")
+            _LOG.error("❌ Error: %s", e)
             error_msg = f"❌ Error: {str(e)}\n\n"
             if 'sql_query' in locals():
                 error_msg += f"**SQL:**\n```sql\n{sql_query}\n```"
             return error_msg
 
-    def _format_results(self, user_question, results, date_context, query_type):
-        """Format results using LLM"""
+    def process_batch(self, messages, company_id):
+        """
+        Answer several independent questions concurrently
+
+        Dashboard-style callers that fire N questions get them answered
+        in roughly max(question_i) wall time instead of the sum: each
+        worker runs the full classify -> execute -> format pipeline, and
+        the Groq/SQL layers underneath already pool, cache, and coalesce
+        duplicate work across threads.
+
+        Returns:
+            List of formatted responses, in the same order as messages
+        """
+        futures = [
+            _EXECUTOR.submit(self.process_query, message, company_id)
+            for message in messages
+        ]
+        return [future.result() for future in futures]
+
+    def _format_results(self, user_question, results, date_context, query_type,
+                        use_llm_format=False):
+        """
+        Format results for display
+
+        The deterministic _basic_format path is the default: tabular
+        results don't need an LLM, and skipping the second Groq call
+        halves LLM latency (and tokens billed) per question. Pass
+        use_llm_format=True for narrative summaries.
+        """
 
         if not results or len(results) == 0:
             return f"ℹ️ **No data found.**\n**📅 Period:** {date_context['label']}"
 
-        results_json = json.dumps(results[:20], default=str, indent=2)
+        if not use_llm_format:
+            return self._basic_format(results, date_context)
+
+        # Rows are already capped DB-side by max_rows for limit-bearing
+        # templates; only copy when something actually exceeds 20
+        display_rows = results if len(results) <= 20 else results[:20]
+        results_json = orjson.dumps(
+            display_rows, default=str,
+            option=orjson.OPT_INDENT_2 | orjson.OPT_SERIALIZE_NUMPY
+        ).decode()
+
+        # Identical data formats identically; reuse the last answer
+        format_key = (query_type, hash(results_json), date_context['label'])
+        with self._memo_lock:
+            cached_text = self._format_cache.get(format_key)
+        if cached_text is not None:
+            _LOG.info("⚡ Format cache hit: %s", query_type)
+            return cached_text
 
         prompt = f"""Format this sales data into a clean, readable summary. DO NOT return JSON.
 
@@ -882,53 +1900,52 @@ Now format the data above:"""
             # Clean up any JSON that might have leaked through
             formatted_text = formatted_text.strip()
 
-            # Remove JSON code blocks if present
-            if formatted_text.startswith('```json'):
-                formatted_text = formatted_text.replace('```json', '').replace('```', '').strip()
+            # Strip literal code fences without a regex pass; the fences
+            # are always at the edges when present
+            if formatted_text.startswith('```'):
+                formatted_text = formatted_text.removeprefix('```json').removeprefix('```')
+                formatted_text = formatted_text.removesuffix('```').strip()
 
             # If it still looks like JSON, use basic format instead
             if formatted_text.startswith('{') or formatted_text.startswith('['):
-                print("⚠️ LLM returned JSON despite instructions, using basic format")
+                _LOG.warning("⚠️ LLM returned JSON despite instructions, using basic format")
                 return self._basic_format(results, date_context)
 
+            with self._memo_lock:
+                self._format_cache[format_key] = formatted_text
             return formatted_text
 
         except Exception as e:
-            print(f"Formatting error: {e}")
+            _LOG.error("Formatting error: %s", e)
             return self._basic_format(results, date_context)
 
     def _basic_format(self, results, date_context):
-        """Fallback formatting - clean readable output"""
-        response = f"**📊 Query Results**\n**📅 Period:** {date_context['label']}\n\n"
+        """Fallback formatting - clean readable output
+
+        Built as a list of chunks joined once at the end; += on a
+        growing string copies the whole response per line.
+        """
+        parts = [f"**📊 Query Results**\n**📅 Period:** {date_context['label']}\n\n"]
 
         if len(results) == 1:
             # Single row result (like totals)
             result = results[0]
             for key, value in result.items():
                 formatted_key = key.replace('_', ' ').title()
+                kind = _basic_field_kind(key.lower())
 
                 if value is None:
-                    response += f"**{formatted_key}:** N/A\n"
+                    parts.append(f"**{formatted_key}:** N/A\n")
                 elif isinstance(value, (int, float)):
-                    # Determine formatting based on field name
-                    if any(k in key.lower() for k in ['revenue', 'sales', 'total', 'amount', 'price', 'cost', 'profit']):
-                        response += f"💰 **{formatted_key}:** ${value:,.2f}\n"
-                    elif any(k in key.lower() for k in ['quantity', 'qty', 'units', 'sold']):
-                        response += f"📦 **{formatted_key}:** {int(value):,} units\n"
-                    elif any(k in key.lower() for k in ['count', 'invoices', 'orders', 'customers']):
-                        response += f"📊 **{formatted_key}:** {int(value):,}\n"
-                    elif 'percent' in key.lower() or 'pct' in key.lower():
-                        response += f"📈 **{formatted_key}:** {value:.2f}%\n"
-                    else:
-                        response += f"**{formatted_key}:** {value:,.2f}\n"
-                elif 'date' in key.lower():
-                    response += f"📅 **{formatted_key}:** {value}\n"
+                    parts.append(_BASIC_SUMMARY_FORMATTERS[kind](formatted_key, value))
+                elif kind == 'date':
+                    parts.append(f"📅 **{formatted_key}:** {value}\n")
                 else:
-                    response += f"**{formatted_key}:** {value}\n"
+                    parts.append(f"**{formatted_key}:** {value}\n")
 
         else:
             # Multiple rows - show as table
-            response += f"**Found {len(results)} results:**\n\n"
+            parts.append(f"**Found {len(results)} results:**\n\n")
 
             # Get column names
             if results:
@@ -936,8 +1953,14 @@ Now format the data above:"""
                 formatted_headers = [h.replace('_', ' ').title() for h in headers]
 
                 # Create markdown table
-                response += "| " + " | ".join(formatted_headers) + " |\n"
-                response += "|" + "|".join(["---" for _ in headers]) + "|\n"
+                parts.append("| " + " | ".join(formatted_headers) + " |\n")
+                parts.append("|" + "|".join(["---" for _ in headers]) + "|\n")
+
+                # One formatter per column, resolved before the row loop
+                formatters = {
+                    key: _BASIC_CELL_FORMATTERS[_basic_field_kind(key.lower())]
+                    for key in headers
+                }
 
                 # Add rows (limit to 10 for readability)
                 for row in results[:10]:
@@ -946,22 +1969,37 @@ Now format the data above:"""
                         if value is None:
                             cells.append("N/A")
                         elif isinstance(value, (int, float)):
-                            if any(k in key.lower() for k in ['revenue', 'sales', 'total', 'amount', 'price', 'cost', 'profit']):
-                                cells.append(f"${value:,.2f}")
-                            elif any(k in key.lower() for k in ['quantity', 'qty', 'units']):
-                                cells.append(f"{int(value):,} units")
-                            elif any(k in key.lower() for k in ['count', 'invoices', 'orders']):
-                                cells.append(f"{int(value):,}")
-                            else:
-                                cells.append(f"{value:,.2f}")
+                            cells.append(formatters[key](value))
                         else:
                             cells.append(str(value))
-                    response += "| " + " | ".join(cells) + " |\n"
+                    parts.append("| " + " | ".join(cells) + " |\n")
 
                 if len(results) > 10:
-                    response += f"\n*Showing 10 of {len(results)} results*\n"
-
-        return response
+                    parts.append(f"\n*Showing 10 of {len(results)} results*\n")
+
+        return ''.join(parts)
+
+    def get_today_summary(self, company_id):
+        """Fetch today's sales/returns/net trio in one parallel round"""
+        results = self._execute_many({
+            'sales_today': {'company_id': company_id},
+            'returns_today': {'company_id': company_id},
+            'net_sales': {
+                'company_id': company_id,
+                'date_filter': self._get_date_filter('today'),
+            },
+        })
+        return {name: rows for name, (rows, _) in results.items()}
+
+    def get_dashboard_summary(self, company_id):
+        """
+        All nine sales/returns/net x today/month/year buckets at once
+
+        One conditional-aggregation scan replaces nine separate
+        sales_invoice queries.
+        """
+        rows, _ = self._execute_template('dashboard_summary', company_id=company_id)
+        return rows[0] if rows else None
 
     # Compatibility methods
     def get_sales_today(self, company_id, date_range=None):
@@ -6,8 +6,11 @@ import streamlit as st
 from agents.sales_agent import SalesAgent
 from database.db_connection import db
 
-# Initialize
-sales_agent = SalesAgent()
+
+@st.cache_resource
+def get_sales_agent():
+    """Build the agent once per server process; Streamlit reruns reuse it"""
+    return SalesAgent()
 
 # Page config
 st.set_page_config(
@@ -152,7 +155,7 @@ What would you like to know?"""
             with st.spinner("🤖 Analyzing your data with AI..."):
                 try:
                     # Use the OpenRouter-powered agent
-                    response = sales_agent.process_query(prompt, company_id)
+                    response = get_sales_agent().process_query(prompt, company_id)
 
                     # Check if it's a credit error
                     if "CREDITS EXHAUSTED" in response or "402" in response:
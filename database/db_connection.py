@@ -2,9 +2,10 @@
 Database Connection Module - READ ONLY
 Highest security standards with SQL injection prevention
 """
+import concurrent.futures
 import mysql.connector
 import streamlit as st
-from mysql.connector import Error
+from mysql.connector import Error, pooling
 import pandas as pd
 import os
 from dotenv import load_dotenv
@@ -12,12 +13,20 @@ import re
 
 load_dotenv()
 
+# Worker pool for overlapping independent queries; sized just under the
+# connection pool so concurrent checkouts never exhaust it
+_EXECUTOR = concurrent.futures.ThreadPoolExecutor(max_workers=8)
+
+# Validation patterns compiled once; _validate_read_only runs on every query
+_STRING_LITERAL_RE = re.compile(r'(\"[^\"]*\"|\'[^\']*\')')
+_COMMENT_RE = re.compile(r'(--[^\n]*|/\*.*?\*/)', re.DOTALL)
+
 
 class DatabaseConnection:
     """Secure read-only database connection with validation"""
 
     def __init__(self):
-        self.connection = None
+        self.pool = None
         self.current_company_id = None
 
         # Load config with validation
@@ -53,42 +62,53 @@ class DatabaseConnection:
         except (ValueError, TypeError):
             raise ValueError(f"Invalid company_id: {company_id}. Must be numeric.")
 
+    def _get_pool(self):
+        """Get or lazily create the shared connection pool"""
+        if self.pool is None:
+            self.pool = pooling.MySQLConnectionPool(
+                pool_name='sales_chatbot',
+                pool_size=10,
+                pool_reset_session=True,
+                **self.config
+            )
+        return self.pool
+
     def get_connection(self):
-        """Get or create database connection with retry logic"""
+        """
+        Check out a connection from the pool
+
+        Caller must close() the connection to return it to the pool.
+        """
         try:
-            if self.connection is None:
-                self.connection = mysql.connector.connect(**self.config)
-                if self.connection.is_connected():
-                    return self.connection
-                return None
-            else:
-                # Verify existing connection
-                try:
-                    self.connection.ping(reconnect=True, attempts=3, delay=5)
-                    if self.connection.is_connected():
-                        return self.connection
-                except Error:
-                    # Reconnect if ping fails
-                    self.connection = mysql.connector.connect(**self.config)
-                    return self.connection if self.connection.is_connected() else None
+            connection = self._get_pool().get_connection()
+
+            # Verify the pooled connection is still alive (MySQL may have
+            # dropped it after wait_timeout); ping reconnects transparently
+            try:
+                connection.ping(reconnect=True, attempts=3, delay=5)
+            except Error:
+                connection.close()
+                connection = self._get_pool().get_connection()
+
+            return connection
         except Error as e:
             st.error(f"Database connection error: {str(e)}")
-            self.connection = None
             return None
 
     def close_connection(self):
-        """Close database connection"""
-        if self.connection and self.connection.is_connected():
-            self.connection.close()
-        self.connection = None
+        """Drop the pool so the next query builds a fresh one"""
+        self.pool = None
 
-    def execute_query(self, query, params=None):
+    def execute_query(self, query, params=None, max_rows=None):
         """
         Execute READ-ONLY query with security validation
 
         Args:
             query: SQL query string with %s placeholders
             params: Tuple of parameters for the query
+            max_rows: Optional row cap; when set, the query runs on an
+                unbuffered cursor and only max_rows rows are fetched, so
+                memory stays O(max_rows) for top-N queries
 
         Returns:
             List of dictionaries with query results
@@ -102,15 +122,47 @@ class DatabaseConnection:
             return None
 
         try:
-            cursor = connection.cursor(dictionary=True)
+            cursor = connection.cursor(dictionary=True, buffered=max_rows is None)
             cursor.execute(query, params or ())
-            result = cursor.fetchall()
+            if max_rows is None:
+                result = cursor.fetchall()
+            else:
+                result = cursor.fetchmany(max_rows)
+                # Drain any remainder so the pooled connection is clean
+                cursor.fetchall()
             cursor.close()
             return result
         except Error as e:
             st.error(f"Query execution error: {str(e)}")
-            self.close_connection()
             return None
+        finally:
+            # Return the connection to the pool
+            connection.close()
+
+    def execute_queries_concurrent(self, queries):
+        """
+        Execute several read-only queries with overlapped I/O
+
+        Args:
+            queries: List of query strings, or (query, params) tuples
+
+        Each query checks out its own pooled connection in a worker
+        thread; the driver waits on the socket without holding the GIL,
+        so total wall time approaches the slowest query rather than the
+        sum. Useful when a dashboard view fans out independent SELECTs.
+
+        Returns:
+            List of result lists, in the same order as queries
+        """
+        normalized = [
+            query if isinstance(query, tuple) else (query, None)
+            for query in queries
+        ]
+        futures = [
+            _EXECUTOR.submit(self.execute_query, query, params)
+            for query, params in normalized
+        ]
+        return [future.result() for future in futures]
 
     def execute_query_dataframe(self, query, params=None):
         """Execute query and return as pandas DataFrame"""
@@ -123,12 +175,10 @@ class DatabaseConnection:
         Raises exception if write operations detected
         """
         # Remove string literals to avoid false positives
-        string_pattern = r'(\"[^\"]*\"|\'[^\']*\')'
-        query_clean = re.sub(string_pattern, "''", query)
+        query_clean = _STRING_LITERAL_RE.sub("''", query)
 
         # Remove comments
-        comment_pattern = r'(--[^\n]*|/\*.*?\*/)'
-        query_clean = re.sub(comment_pattern, '', query_clean, flags=re.DOTALL)
+        query_clean = _COMMENT_RE.sub('', query_clean)
 
         # Check for write operations
         query_upper = query_clean.upper().strip()
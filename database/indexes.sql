@@ -0,0 +1,43 @@
+-- Composite indexes for the chatbot's query templates
+--
+-- Every template filters sales_invoice by company_id + a date range (+
+-- status/salesman/warehouse), or stock by company_id + stock_type +
+-- quantity < 0. Without these, MySQL falls back to full scans. Run once
+-- per deployment; MySQL has no CREATE INDEX IF NOT EXISTS, so re-running
+-- reports duplicate-key-name errors that can be ignored.
+
+-- sales_* / returns_* / net_sales_* / compare_* / dashboard_summary
+CREATE INDEX idx_si_company_date_status
+    ON sales_invoice (company_id, invoice_date, status);
+
+-- sales_by_salesperson / highest_salesperson / top_salespeople
+CREATE INDEX idx_si_company_salesman_date
+    ON sales_invoice (company_id, salesman, invoice_date);
+
+-- branch templates
+CREATE INDEX idx_si_company_warehouse_date
+    ON sales_invoice (company_id, warehouse_id, invoice_date);
+
+-- customer templates (top/lowest revenue, customer-wise, inactive);
+-- trailing status makes the inactive_customers NOT EXISTS probe and
+-- MAX(invoice_date) subquery fully index-covered
+CREATE INDEX idx_si_company_customer_date_status
+    ON sales_invoice (company_id, customer_id, invoice_date, status);
+
+-- product/category rollup refresh source scan
+CREATE INDEX idx_stock_company_type_qty
+    ON stock (company_id, stock_type, quantity, product_id);
+
+CREATE INDEX idx_stock_invoice
+    ON stock (invoice_id);
+
+-- Ollama fast-path templates aggregate sales_items per tenant; MySQL has
+-- no INCLUDE clause, so the measure columns ride along as trailing key
+-- parts to make the join + SUM fully index-covered
+CREATE INDEX idx_sit_company_invoice_product
+    ON sales_items (company_id, invoice_id, product_id, quantity, total);
+
+-- product rollup refresh probes sales_items by (invoice, product) and
+-- reads price/discount
+CREATE INDEX idx_sit_invoice_product
+    ON sales_items (invoice_id, product_id, price, discount);
@@ -0,0 +1,64 @@
+-- Product-day rollup for product and category queries
+--
+-- The product/category templates used to run a 4-way join across stock,
+-- products, sales_invoice and sales_items on every question. This rollup
+-- pre-aggregates that join to one row per (company, day, product); the
+-- chatbot then only joins products/products_category to resolve names for
+-- the top-N rows.
+--
+-- Run once against the reporting database; the event refreshes nightly
+-- (requires the event scheduler, see sales_daily_rollup.sql).
+
+CREATE TABLE IF NOT EXISTS product_daily_rollup (
+    company_id   INT            NOT NULL,
+    sales_day    DATE           NOT NULL,
+    product_id   INT            NOT NULL,
+    category_id  INT,
+    qty          DECIMAL(18, 2) NOT NULL DEFAULT 0,
+    revenue      DECIMAL(18, 2) NOT NULL DEFAULT 0,
+    cost_amount  DECIMAL(18, 2) NOT NULL DEFAULT 0,
+    PRIMARY KEY (company_id, sales_day, product_id),
+    KEY idx_company_day_category (company_id, sales_day, category_id)
+);
+
+REPLACE INTO product_daily_rollup
+    (company_id, sales_day, product_id, category_id, qty, revenue, cost_amount)
+SELECT s.company_id,
+       DATE(si.invoice_date),
+       s.product_id,
+       p.category_id,
+       SUM(ABS(s.quantity)),
+       SUM(ABS(s.quantity) * (si_item.price - si_item.discount)),
+       SUM(ABS(s.quantity) * s.cost)
+FROM stock s
+JOIN products p ON p.product_id = s.product_id
+JOIN sales_invoice si ON si.invoice_id = s.invoice_id
+JOIN sales_items si_item
+    ON si_item.product_id = s.product_id AND si_item.invoice_id = s.invoice_id
+WHERE s.stock_type = 'sales'
+  AND s.quantity < 0
+  AND si.status != 'canceled'
+GROUP BY s.company_id, DATE(si.invoice_date), s.product_id, p.category_id;
+
+CREATE EVENT IF NOT EXISTS refresh_product_daily_rollup
+ON SCHEDULE EVERY 1 DAY
+STARTS (CURRENT_DATE + INTERVAL 1 DAY + INTERVAL 10 MINUTE)
+DO
+    REPLACE INTO product_daily_rollup
+        (company_id, sales_day, product_id, category_id, qty, revenue, cost_amount)
+    SELECT s.company_id,
+           DATE(si.invoice_date),
+           s.product_id,
+           p.category_id,
+           SUM(ABS(s.quantity)),
+           SUM(ABS(s.quantity) * (si_item.price - si_item.discount)),
+           SUM(ABS(s.quantity) * s.cost)
+    FROM stock s
+    JOIN products p ON p.product_id = s.product_id
+    JOIN sales_invoice si ON si.invoice_id = s.invoice_id
+    JOIN sales_items si_item
+        ON si_item.product_id = s.product_id AND si_item.invoice_id = s.invoice_id
+    WHERE s.stock_type = 'sales'
+      AND s.quantity < 0
+      AND si.status != 'canceled'
+    GROUP BY s.company_id, DATE(si.invoice_date), s.product_id, p.category_id;
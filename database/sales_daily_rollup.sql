@@ -0,0 +1,53 @@
+-- Daily sales rollup for trend / day-extreme queries
+--
+-- sales_trend_12_months, highest_sales_day and lowest_sales_day used to scan
+-- the full sales_invoice table on every question. This rollup keeps one row
+-- per (company, day, sale/return bucket) so those queries read at most a few
+-- hundred rows instead of millions of invoices.
+--
+-- Run this script once against the reporting database. The refresh event
+-- rebuilds the rollup shortly after midnight; enable the scheduler with
+-- SET GLOBAL event_scheduler = ON if it is not already running.
+
+CREATE TABLE IF NOT EXISTS sales_daily_rollup (
+    company_id     INT            NOT NULL,
+    sales_day      DATE           NOT NULL,
+    status_bucket  ENUM('sale', 'return') NOT NULL,
+    gross          DECIMAL(18, 2) NOT NULL DEFAULT 0,
+    tax            DECIMAL(18, 2) NOT NULL DEFAULT 0,
+    net            DECIMAL(18, 2) NOT NULL DEFAULT 0,
+    invoice_count  INT            NOT NULL DEFAULT 0,
+    PRIMARY KEY (company_id, sales_day, status_bucket)
+);
+
+-- Full rebuild; REPLACE keeps the statement idempotent so it can also be run
+-- by hand to backfill or repair the rollup.
+REPLACE INTO sales_daily_rollup
+    (company_id, sales_day, status_bucket, gross, tax, net, invoice_count)
+SELECT company_id,
+       DATE(invoice_date),
+       IF(status = 'return', 'return', 'sale'),
+       SUM(total),
+       SUM(COALESCE(total_tax, 0)),
+       SUM(total - COALESCE(total_tax, 0)),
+       COUNT(*)
+FROM sales_invoice
+WHERE status NOT IN ('draft', 'draft_return', 'canceled')
+GROUP BY company_id, DATE(invoice_date), IF(status = 'return', 'return', 'sale');
+
+CREATE EVENT IF NOT EXISTS refresh_sales_daily_rollup
+ON SCHEDULE EVERY 1 DAY
+STARTS (CURRENT_DATE + INTERVAL 1 DAY + INTERVAL 5 MINUTE)
+DO
+    REPLACE INTO sales_daily_rollup
+        (company_id, sales_day, status_bucket, gross, tax, net, invoice_count)
+    SELECT company_id,
+           DATE(invoice_date),
+           IF(status = 'return', 'return', 'sale'),
+           SUM(total),
+           SUM(COALESCE(total_tax, 0)),
+           SUM(total - COALESCE(total_tax, 0)),
+           COUNT(*)
+    FROM sales_invoice
+    WHERE status NOT IN ('draft', 'draft_return', 'canceled')
+    GROUP BY company_id, DATE(invoice_date), IF(status = 'return', 'return', 'sale');